@@ -1,4 +1,4 @@
-import sys, time, socket, threading, json
+import sys, time, socket, threading, json, struct
 from collections import deque
 
 from PyQt5.QtWidgets import (
@@ -96,6 +96,7 @@ class LayerB_SCADASupervisor(QWidget):
         self.status_updates = 0
         self.start_time = time.time()
         self.command_history = deque(maxlen=10)
+        self._history_dirty = False
 
         # signals
         self.signals = SignalEmitter()
@@ -116,10 +117,13 @@ class LayerB_SCADASupervisor(QWidget):
         # Thread poll A
         self._start_modbus_poll_thread()
 
-        # Stats update timer
-        self.stats_timer = QTimer()
-        self.stats_timer.timeout.connect(self.update_statistics)
-        self.stats_timer.start(1000)
+        # Một timer 250ms cho stats (1s), command history và reset FORWARDING
+        self._tick_count = 0
+        self._forward_reset_deadline = None
+        self._master_timer = QTimer(self)
+        self._master_timer.setInterval(250)
+        self._master_timer.timeout.connect(self._master_tick)
+        self._master_timer.start()
 
     # =========================================================
     #   UI
@@ -194,6 +198,18 @@ class LayerB_SCADASupervisor(QWidget):
         conn_frame.setLayout(conn_layout)
         topology_layout.addWidget(conn_frame)
 
+        self.lbl_forward_status = QLabel("Idle")
+        self.lbl_forward_status.setAlignment(Qt.AlignCenter)
+        self.lbl_forward_status.setStyleSheet("""
+            background: #b0b0b0;
+            color: white;
+            font-size: 12pt;
+            font-weight: bold;
+            padding: 12px;
+            border-radius: 8px;
+        """)
+        topology_layout.addWidget(self.lbl_forward_status)
+
         topology_group.setLayout(topology_layout)
         layout.addWidget(topology_group)
 
@@ -688,6 +704,20 @@ class LayerB_SCADASupervisor(QWidget):
         """)
         log_layout.addWidget(self.log_text)
 
+        log_layout.addWidget(QLabel("Command history (from C):"))
+        self.history_text = QPlainTextEdit()
+        self.history_text.setReadOnly(True)
+        self.history_text.setMaximumHeight(90)
+        self.history_text.setStyleSheet("""
+            background: #f5f5f5;
+            color: #333333;
+            font-family: 'Courier New';
+            font-size: 9pt;
+            border-radius: 5px;
+            border: 1px solid #d0d0d0;
+        """)
+        log_layout.addWidget(self.history_text)
+
         log_group.setLayout(log_layout)
         layout.addWidget(log_group)
 
@@ -724,20 +754,18 @@ class LayerB_SCADASupervisor(QWidget):
         t = threading.Thread(target=loop, daemon=True)
         t.start()
 
-    @staticmethod
-    def _regs_to_s32(hi, lo):
-        val = ((hi & 0xFFFF) << 16) | (lo & 0xFFFF)
-        if val & 0x80000000:
-            val = val - (1 << 32)
-        return val
-
-    @staticmethod
-    def _s32_to_regs(val):
-        if val < 0:
-            val = (1 << 32) + val
-        hi = (val >> 16) & 0xFFFF
-        lo = val & 0xFFFF
-        return hi, lo
+    # Hai thanh ghi 16-bit (hi, lo) <-> 32-bit big-endian
+    _REGS_U16X2 = struct.Struct(">HH")
+    _S32 = struct.Struct(">i")
+    _U32 = struct.Struct(">I")
+
+    @classmethod
+    def _regs_to_s32(cls, hi, lo):
+        return cls._S32.unpack(cls._REGS_U16X2.pack(hi & 0xFFFF, lo & 0xFFFF))[0]
+
+    @classmethod
+    def _s32_to_regs(cls, val):
+        return cls._REGS_U16X2.unpack(cls._U32.pack(val & 0xFFFFFFFF))
 
     def poll_a_status_from_a(self):
         """Đọc Input Registers 0..11 từ Layer A (mở rộng thêm STEP/JOG)."""
@@ -927,6 +955,12 @@ class LayerB_SCADASupervisor(QWidget):
                     try:
                         self.server_socket.settimeout(1.0)
                         client, addr = self.server_socket.accept()
+                        # Gửi JSON ngay, không chờ gom gói (tắt Nagle)
+                        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        # Phát hiện Layer C mất kết nối (recv không chờ mãi)
+                        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                        if hasattr(socket, "TCP_KEEPIDLE"):
+                            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
 
                         if self.client_c:
                             try:
@@ -1001,7 +1035,7 @@ class LayerB_SCADASupervisor(QWidget):
 
         timestamp = time.strftime("%H:%M:%S")
         self.command_history.append(f"[{timestamp}] {source} → {cmd_type}")
-        self.update_command_history()
+        self._history_dirty = True
 
         allowed = {'motor_control', 'jog_control', 'stop_motor',
                    'release_control', 'emergency_stop', 'set_target', 'set_mode'}
@@ -1180,7 +1214,7 @@ class LayerB_SCADASupervisor(QWidget):
             padding: 12px;
             border-radius: 8px;
         """)
-        QTimer.singleShot(1000, self.reset_forward_status)
+        self._forward_reset_deadline = time.monotonic() + 1.0
 
     def reset_forward_status(self):
         self.lbl_forward_status.setText("Idle")
@@ -1193,7 +1227,23 @@ class LayerB_SCADASupervisor(QWidget):
             border-radius: 8px;
         """)
 
+    def _master_tick(self):
+        self._tick_count += 1
+        self.update_command_history()
+
+        if (self._forward_reset_deadline is not None
+                and time.monotonic() >= self._forward_reset_deadline):
+            self._forward_reset_deadline = None
+            self.reset_forward_status()
+
+        if self._tick_count % 4 == 0:
+            self.update_statistics()
+
     def update_command_history(self):
+        # Chỉ vẽ lại khi có lệnh mới từ C (gọi từ _master_tick trên GUI thread)
+        if not self._history_dirty:
+            return
+        self._history_dirty = False
         self.history_text.clear()
         for line in list(self.command_history):
             self.history_text.appendPlainText(line)
@@ -1459,7 +1509,7 @@ class LayerB_SCADASupervisor(QWidget):
 
     def closeEvent(self, event):
         self.running = False
-        self.stats_timer.stop()
+        self._master_timer.stop()
 
         if self.modbus_client_a:
             try:
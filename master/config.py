@@ -15,6 +15,9 @@ A_HR_MODE_ADDR = 8
 A_HR_CMD_ADDR = 10
 A_HR_CMD_REG_COUNT = 6
 
+# Chu kỳ polling trạng thái Layer A (giây)
+A_POLL_INTERVAL = 0.5
+
 # Auto State Mapping
 AUTO_STATE_MAP = {
     0: "Idle",
@@ -11,6 +11,7 @@ class ModbusClientA:
         self.client = None
         self.polling_active = False
         self.polling_thread = None
+        self._stop_polling = threading.Event()
         self.modbus_connected = False
         self.commands_forwarded = 0
         
@@ -68,21 +69,31 @@ class ModbusClientA:
             return
             
         self.polling_active = True
+        self._stop_polling.clear()
         self.polling_thread = threading.Thread(target=self.poll_loop, daemon=True)
         self.polling_thread.start()
 
     def stop_polling(self):
         """Dừng polling dữ liệu"""
         self.polling_active = False
+        self._stop_polling.set()
         if self.polling_thread:
             self.polling_thread.join(timeout=2.0)
             self.polling_thread = None
 
     def poll_loop(self):
-        """Vòng lặp polling"""
+        """Vòng lặp polling theo lịch monotonic (không trôi chu kỳ)"""
+        next_tick = time.monotonic()
         while self.polling_active and self.modbus_connected:
+            next_tick += A_POLL_INTERVAL
             self.poll_status()
-            time.sleep(0.5)
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                # stop_polling() đánh thức ngay thay vì chờ hết chu kỳ
+                if self._stop_polling.wait(delay):
+                    break
+            else:
+                next_tick = time.monotonic()
 
     def poll_status(self):
         """Đọc trạng thái từ Layer A"""
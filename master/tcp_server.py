@@ -36,6 +36,12 @@ class TCPServerForC(QObject):
                     try:
                         self.server_socket.settimeout(1.0)
                         client, addr = self.server_socket.accept()
+                        # Gửi JSON ngay, không chờ gom gói (tắt Nagle)
+                        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        # Phát hiện Layer C mất kết nối (recv không chờ mãi)
+                        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                        if hasattr(socket, "TCP_KEEPIDLE"):
+                            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
 
                         if self.client_c:
                             try:
@@ -1,6 +1,13 @@
+import struct
+
 from PyQt5.QtCore import QObject, pyqtSignal
 from config import AUTO_STATE_MAP
 
+# Two 16-bit registers (hi, lo) <-> big-endian 32-bit value
+_REGS_U16X2 = struct.Struct(">HH")
+_S32 = struct.Struct(">i")
+_U32 = struct.Struct(">I")
+
 
 class SignalEmitter(QObject):
     log_signal = pyqtSignal(str)
@@ -11,19 +18,12 @@ class SignalEmitter(QObject):
 
 def regs_to_s32(hi, lo):
     """Convert two 16-bit registers to signed 32-bit integer"""
-    val = ((hi & 0xFFFF) << 16) | (lo & 0xFFFF)
-    if val & 0x80000000:
-        val = val - (1 << 32)
-    return val
+    return _S32.unpack(_REGS_U16X2.pack(hi & 0xFFFF, lo & 0xFFFF))[0]
 
 
 def s32_to_regs(val):
     """Convert signed 32-bit integer to two 16-bit registers"""
-    if val < 0:
-        val = (1 << 32) + val
-    hi = (val >> 16) & 0xFFFF
-    lo = val & 0xFFFF
-    return hi, lo
+    return _REGS_U16X2.unpack(_U32.pack(val & 0xFFFFFFFF))
 
 
 def validate_pos_speed(pos: int, speed: int) -> bool:
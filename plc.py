@@ -1,7 +1,11 @@
 import sys
 import time
+import math
 import struct
 import threading
+from array import array
+from collections import deque
+from functools import lru_cache
 import serial
 
 from PyQt5.QtWidgets import (
@@ -10,7 +14,7 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject
 
-from pyModbusTCP.server import ModbusServer
+from pyModbusTCP.server import ModbusServer, DataBank
 
 # ==========================
 # CẤU HÌNH HỆ THỐNG
@@ -19,6 +23,11 @@ MODBUS_TCP_PORT = 502
 
 SERIAL_TIMEOUT = 1.0
 READ_INTERVAL_MS = 300
+AUTO_INTERVAL_MS = 200
+# Một QTimer chung, chu kỳ = ước chung lớn nhất của 2 chu kỳ trên
+TICK_MS = math.gcd(READ_INTERVAL_MS, AUTO_INTERVAL_MS)
+LOG_MAX_LINES = 500       # số dòng log giữ lại trên UI
+LOG_FLUSH_MS = 100        # chu kỳ đẩy log đang chờ lên UI
 
 SLAVE_ID_DRIVER = 2
 SLAVE_ID_SHT20 = 1
@@ -34,20 +43,78 @@ HR_MODE_ADDR = 8          # 0=AUTO, 1=MANUAL
 HR_CMD_ADDR = 10          # packet lệnh MANUAL từ B/C
 HR_CMD_REG_COUNT = 6      # CMD, POS_HI, POS_LO, SPEED, SOURCE, PRIORITY
 
+# QSS cho label trạng thái: màu chọn theo property kind/state,
+# update_ui chỉ đổi property "state" (không parse lại stylesheet mỗi lần)
+_STATUS_QSS = """
+    QLabel[kind] { font-weight:bold; }
+    QLabel[kind="mode"] { font-size:11pt; }
+    QLabel[kind="sht"][state="on"] { color:#27ae60; }
+    QLabel[kind="sht"][state="off"] { color:#c0392b; }
+    QLabel[kind="alarm"][state="on"] { color:#c0392b; }
+    QLabel[kind="alarm"][state="off"] { color:#27ae60; }
+    QLabel[kind="inpos"][state="on"] { color:#27ae60; }
+    QLabel[kind="inpos"][state="off"] { color:#f39c12; }
+    QLabel[kind="run"][state="on"] { color:#3498db; }
+    QLabel[kind="run"][state="off"] { color:#95a5a6; }
+    QLabel[kind="done"][state="on"] { color:#27ae60; }
+    QLabel[kind="done"][state="off"] { color:#95a5a6; }
+    QLabel[kind="mode"][state="on"] { color:#e67e22; }
+    QLabel[kind="mode"][state="off"] { color:#27ae60; }
+"""
+
 
 # ==========================
 # MODBUS RTU HELPER
 # ==========================
-def crc16_modbus(data: bytes) -> int:
-    crc = 0xFFFF
-    for b in data:
-        crc ^= b
+# Request 8 byte: slave, FC, addr/start, value/count (big-endian)
+# + CRC (đã đảo byte để ghi little-endian bằng cùng một Struct)
+_RTU_REQ = struct.Struct(">BBHHH")
+_RTU_HDR16 = struct.Struct(">BBHHB")    # slave, 0x10, start, count, byte count
+_RTU_CRC = struct.Struct("<H")
+
+
+def _crc16_table() -> array:
+    table = array('H')
+    for b in range(256):
+        crc = b
         for _ in range(8):
             if crc & 1:
                 crc = (crc >> 1) ^ 0xA001
             else:
                 crc >>= 1
-    return crc & 0xFFFF
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _crc16_table()
+
+
+def crc16_modbus(data: bytes) -> int:
+    crc = 0xFFFF
+    table = CRC16_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+def _crc16_6(b0: int, b1: int, b2: int, b3: int, b4: int, b5: int) -> int:
+    # CRC16 trải phẳng cho đúng 6 byte (phần đầu của request FC03/04/06)
+    t = CRC16_TABLE
+    crc = 0xFF ^ t[0xFF ^ b0]
+    crc = (crc >> 8) ^ t[(crc ^ b1) & 0xFF]
+    crc = (crc >> 8) ^ t[(crc ^ b2) & 0xFF]
+    crc = (crc >> 8) ^ t[(crc ^ b3) & 0xFF]
+    crc = (crc >> 8) ^ t[(crc ^ b4) & 0xFF]
+    return (crc >> 8) ^ t[(crc ^ b5) & 0xFF]
+
+
+def _build_request(slave_id: int, fc: int, addr: int, value: int) -> bytes:
+    # Request 8 byte FC03/04/06 đóng gói bằng một lần pack (CRC gộp vào)
+    slave_id &= 0xFF
+    addr &= 0xFFFF
+    value &= 0xFFFF
+    crc = _crc16_6(slave_id, fc, addr >> 8, addr & 0xFF, value >> 8, value & 0xFF)
+    return _RTU_REQ.pack(slave_id, fc, addr, value, ((crc & 0xFF) << 8) | (crc >> 8))
 
 
 def verify_crc(resp: bytes) -> bool:
@@ -59,75 +126,92 @@ def verify_crc(resp: bytes) -> bool:
     return recv_crc == calc_crc
 
 
+@lru_cache(maxsize=128)
 def build_fc03(slave_id: int, start_reg: int, count: int) -> bytes:
-    data = bytes([
-        slave_id, 0x03,
-        (start_reg >> 8) & 0xFF, start_reg & 0xFF,
-        (count >> 8) & 0xFF, count & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    return _build_request(slave_id, 0x03, start_reg, count)
 
 
+@lru_cache(maxsize=128)
 def build_fc04(slave_id: int, start_reg: int, count: int) -> bytes:
-    data = bytes([
-        slave_id, 0x04,
-        (start_reg >> 8) & 0xFF, start_reg & 0xFF,
-        (count >> 8) & 0xFF, count & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    return _build_request(slave_id, 0x04, start_reg, count)
 
 
+@lru_cache(maxsize=128)
 def build_fc06(slave_id: int, reg_addr: int, reg_val: int) -> bytes:
-    data = bytes([
-        slave_id, 0x06,
-        (reg_addr >> 8) & 0xFF, reg_addr & 0xFF,
-        (reg_val >> 8) & 0xFF, reg_val & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    return _build_request(slave_id, 0x06, reg_addr, reg_val)
+
+
+def expected_response_length(frame: bytes):
+    """Độ dài response RTU bình thường của một request, None nếu không biết"""
+    fc = frame[1]
+    if fc in (0x03, 0x04):
+        # addr + func + bytecount + 2*N data + 2 CRC
+        return 5 + 2 * ((frame[4] << 8) | frame[5])
+    if fc in (0x06, 0x10):
+        # echo addr + func + 2 reg + 2 value/count + 2 CRC
+        return 8
+    return None
+
+
+def response_length_from_header(head: bytes):
+    """Độ dài response RTU suy từ 3 byte đầu (addr, func, bytecount), None nếu không biết"""
+    fc = head[1]
+    if fc & 0x80:
+        return 5                    # exception: addr + func + code + 2 CRC
+    if fc in (0x01, 0x02, 0x03, 0x04):
+        return 5 + head[2]
+    if fc in (0x05, 0x06, 0x0F, 0x10):
+        return 8
+    return None
 
 
 def build_fc16(slave_id: int, start_reg: int, registers: list) -> bytes:
+    return _build_fc16(slave_id, start_reg, tuple(registers))
+
+
+@lru_cache(maxsize=128)
+def _build_fc16(slave_id: int, start_reg: int, registers: tuple) -> bytes:
     reg_count = len(registers)
-    byte_count = reg_count * 2
-    data = bytearray([
-        slave_id, 0x10,
-        (start_reg >> 8) & 0xFF, start_reg & 0xFF,
-        (reg_count >> 8) & 0xFF, reg_count & 0xFF,
-        byte_count
-    ])
-    for reg in registers:
-        data.append((reg >> 8) & 0xFF)
-        data.append(reg & 0xFF)
-    crc = crc16_modbus(bytes(data))
-    return bytes(data) + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    data = _RTU_HDR16.pack(slave_id & 0xFF, 0x10, start_reg & 0xFFFF, reg_count, reg_count * 2)
+    data += struct.pack(f">{reg_count}H", *[reg & 0xFFFF for reg in registers])
+    return data + _RTU_CRC.pack(crc16_modbus(data))
 
 
-def pack_u32(val: int) -> list:
-    return [(val >> 16) & 0xFFFF, val & 0xFFFF]
+@lru_cache(maxsize=512)
+def pack_u32(val: int) -> tuple:
+    # Kết quả được cache → trả tuple, không sửa trực tiếp
+    return ((val >> 16) & 0xFFFF, val & 0xFFFF)
 
 
-def pack_s32(val: int) -> list:
+@lru_cache(maxsize=512)
+def pack_s32(val: int) -> tuple:
     if val < 0:
         val = (1 << 32) + val
-    return [(val >> 16) & 0xFFFF, val & 0xFFFF]
+    return ((val >> 16) & 0xFFFF, val & 0xFFFF)
 
 
 def unpack_s32_from_bytes(b: bytes, offset: int) -> int:
-    val = (b[offset] << 24) | (b[offset+1] << 16) | (b[offset+2] << 8) | b[offset+3]
-    if val & 0x80000000:
-        val = val - (1 << 32)
-    return val
+    return int.from_bytes(b[offset:offset + 4], 'big', signed=True)
 
 
 # ==========================
 # SIGNAL EMITTER (thread → UI)
 # ==========================
 class SignalEmitter(QObject):
-    log_signal = pyqtSignal(str)
     tcp_status_signal = pyqtSignal(str)
+    cmd_signal = pyqtSignal()
+
+
+class CmdDataBank(DataBank):
+    """DataBank báo ngay khi client ghi lệnh MANUAL (CMD != 0) vào HR_CMD_ADDR"""
+
+    def __init__(self, on_cmd, **kwargs):
+        super().__init__(**kwargs)
+        self._on_cmd = on_cmd
+
+    def on_holding_registers_change(self, address, from_value, to_value, srv_info):
+        if address == HR_CMD_ADDR and to_value != 0:
+            self._on_cmd()
 
 
 # ==========================
@@ -168,26 +252,37 @@ class LayerA_PLC(QWidget):
         # Target nhận từ Modbus TCP HR0
         self.last_tcp_target = 0
 
+        # MODE đọc từ HR_MODE_ADDR ở mỗi auto_cycle (0=AUTO, 1=MANUAL)
+        self.mode = 0
+
         # Modbus TCP server
         self.modbus_server = None
         self.running = True
 
+        # Hàng đợi log (thread nào cũng append được), UI gom lại append 1 lần
+        self._log_queue = deque()
+        self._log_ts_cache = (0, "")  # (giây, "[HH:MM:SS]") của dòng log gần nhất
+
+        # Giá trị (text, style) đang hiển thị trên từng label → bỏ qua set trùng
+        self._ui_state = {}
+
         # Signals
         self.signals = SignalEmitter()
-        self.signals.log_signal.connect(self.append_log)
         self.signals.tcp_status_signal.connect(self.update_tcp_status)
+        self.signals.cmd_signal.connect(self._on_cmd_written, Qt.QueuedConnection)
+
+        self.timer_log = QTimer()
+        self.timer_log.timeout.connect(self._flush_logs)
+        self.timer_log.start(LOG_FLUSH_MS)
 
         self._build_ui()
         self._start_modbus_tcp_server()
 
         # Timers
-        self.timer_read = QTimer()
-        self.timer_read.timeout.connect(self.read_all_devices)
-        self.timer_read.start(READ_INTERVAL_MS)
-
-        self.timer_auto = QTimer()
-        self.timer_auto.timeout.connect(self.auto_cycle)
-        self.timer_auto.start(200)
+        self._tick_n = 0
+        self.timer = QTimer()
+        self.timer.timeout.connect(self._tick)
+        self.timer.start(TICK_MS)
 
     # --------------------------
     # UI LAYOUT
@@ -310,7 +405,7 @@ class LayerA_PLC(QWidget):
                 subcontrol-position: top left;
                 padding: 0 4px;
             }
-        """)
+        """ + _STATUS_QSS)
         mon_layout = QGridLayout()
 
         self.lbl_temp = QLabel("--.- °C")
@@ -338,7 +433,8 @@ class LayerA_PLC(QWidget):
         mon_layout.addWidget(self.lbl_humi, 0, 1)
 
         self.lbl_sht_status = QLabel("SHT20: OFFLINE")
-        self.lbl_sht_status.setStyleSheet("font-weight:bold; color:#c0392b;")
+        self.lbl_sht_status.setProperty("kind", "sht")
+        self.lbl_sht_status.setProperty("state", "off")
         mon_layout.addWidget(self.lbl_sht_status, 1, 0, 1, 2)
 
         self.lbl_pos = QLabel("Position: 0 pulse")
@@ -346,15 +442,18 @@ class LayerA_PLC(QWidget):
         mon_layout.addWidget(self.lbl_pos, 2, 0, 1, 2)
 
         self.lbl_drv_alarm = QLabel("Alarm: NO")
-        self.lbl_drv_alarm.setStyleSheet("color:#27ae60; font-weight:bold;")
+        self.lbl_drv_alarm.setProperty("kind", "alarm")
+        self.lbl_drv_alarm.setProperty("state", "off")
         mon_layout.addWidget(self.lbl_drv_alarm, 3, 0)
 
         self.lbl_drv_inpos = QLabel("InPos: NO")
-        self.lbl_drv_inpos.setStyleSheet("color:#f39c12; font-weight:bold;")
+        self.lbl_drv_inpos.setProperty("kind", "inpos")
+        self.lbl_drv_inpos.setProperty("state", "off")
         mon_layout.addWidget(self.lbl_drv_inpos, 3, 1)
 
         self.lbl_drv_run = QLabel("Running: NO")
-        self.lbl_drv_run.setStyleSheet("color:#95a5a6; font-weight:bold;")
+        self.lbl_drv_run.setProperty("kind", "run")
+        self.lbl_drv_run.setProperty("state", "off")
         mon_layout.addWidget(self.lbl_drv_run, 4, 0)
 
         self.lbl_counter = QLabel("Counter: 0 / 0")
@@ -362,7 +461,8 @@ class LayerA_PLC(QWidget):
         mon_layout.addWidget(self.lbl_counter, 5, 0, 1, 2)
 
         self.lbl_counter_done = QLabel("Counter DONE: NO")
-        self.lbl_counter_done.setStyleSheet("color:#95a5a6; font-weight:bold;")
+        self.lbl_counter_done.setProperty("kind", "done")
+        self.lbl_counter_done.setProperty("state", "off")
         mon_layout.addWidget(self.lbl_counter_done, 6, 0, 1, 2)
 
         self.lbl_auto_state = QLabel("AUTO STATE: Idle")
@@ -370,7 +470,8 @@ class LayerA_PLC(QWidget):
         mon_layout.addWidget(self.lbl_auto_state, 7, 0, 1, 2)
 
         self.lbl_mode_info = QLabel("MODE: AUTO")
-        self.lbl_mode_info.setStyleSheet("font-size:11pt; font-weight:bold; color:#27ae60;")
+        self.lbl_mode_info.setProperty("kind", "mode")
+        self.lbl_mode_info.setProperty("state", "off")
         mon_layout.addWidget(self.lbl_mode_info, 8, 0, 1, 2)
 
         self.lbl_tcp_target = QLabel("TCP Target: 0")
@@ -400,6 +501,7 @@ class LayerA_PLC(QWidget):
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setMaximumHeight(150)
+        self.log_text.document().setMaximumBlockCount(LOG_MAX_LINES)
         self.log_text.setStyleSheet("""
             background:#f5f5f5;
             color:#333333;
@@ -453,32 +555,43 @@ class LayerA_PLC(QWidget):
         self.btn_disconnect.setEnabled(False)
         self.log("RS485 disconnected")
 
-    def send_frame(self, frame: bytes) -> bytes:
+    def send_frame(self, frame: bytes, expected_len=None) -> bytes:
         if not self.ser or not self.ser.is_open:
             return b""
+        if expected_len is None:
+            expected_len = expected_response_length(frame)
         with self.ser_lock:
             try:
                 self.ser.reset_input_buffer()
                 self.ser.write(frame)
                 self.ser.flush()
-                time.sleep(0.02)
-
-                resp = b""
-                start = time.time()
-                while time.time() - start < SERIAL_TIMEOUT:
-                    chunk = self.ser.read(256)
-                    if chunk:
-                        resp += chunk
-                        time.sleep(0.03)
-                    else:
-                        if resp:
-                            break
-                        time.sleep(0.01)
-                return resp
+                return self._read_response(expected_len)
             except Exception as e:
                 self.log(f"Serial error: {e}")
                 return b""
 
+    def _read_response(self, expected_len) -> bytes:
+        """Đọc response theo framing RTU (gọi khi đã giữ ser_lock)
+
+        read(n) chỉ dừng khi đủ n byte hoặc hết SERIAL_TIMEOUT, nên luôn đọc
+        đúng số byte của frame thay vì read(256) chờ hết timeout.
+        """
+        if expected_len is None:
+            # Không biết trước: suy độ dài từ addr + func + bytecount
+            head = self.ser.read(3)
+            if len(head) < 3:
+                return head
+            total = response_length_from_header(head)
+            if total is None:
+                return head
+            return head + self.ser.read(total - 3)
+
+        # 5 byte đầu đủ để nhận ra exception response (func | 0x80)
+        resp = self.ser.read(5)
+        if len(resp) < 5 or resp[1] & 0x80:
+            return resp
+        return resp + self.ser.read(expected_len - 5)
+
     # --------------------------
     # READ DEVICES
     # --------------------------
@@ -531,9 +644,6 @@ class LayerA_PLC(QWidget):
             self.counter_target = hr1
             self.counter_done = bool(hr2 & 0x0001)
 
-        self.update_ui()
-        self.update_input_registers()
-
     # --------------------------
     # CHECK TARGET FROM TCP
     # --------------------------
@@ -566,6 +676,15 @@ class LayerA_PLC(QWidget):
         except Exception as e:
             self.log(f"Error reading HR{HR_TARGET_ADDR}: {e}")
 
+    # --------------------------
+    # CMD MỚI TỪ MODBUS TCP → xử lý ngay, không chờ tick AUTO kế tiếp
+    # --------------------------
+    def _on_cmd_written(self):
+        if self.mode != 1:
+            return
+        self.process_manual_command()
+        self.update_input_registers()
+
     # --------------------------
     # PROCESS MANUAL COMMAND (ĐÃ SỬA)
     # --------------------------
@@ -626,7 +745,7 @@ class LayerA_PLC(QWidget):
                 frame = build_fc16(
                     SLAVE_ID_DRIVER,
                     0x0030,
-                    speed_regs + [0, 1]   # [speed_hi, speed_lo, 0, dir=1(CW)]
+                    speed_regs + (0, 1)   # [speed_hi, speed_lo, 0, dir=1(CW)]
                 )
 
             # JOG CCW (MOVE VELOCITY CCW)
@@ -635,7 +754,7 @@ class LayerA_PLC(QWidget):
                 frame = build_fc16(
                     SLAVE_ID_DRIVER,
                     0x0030,
-                    speed_regs + [0, 0]   # dir=0(CCW)
+                    speed_regs + (0, 0)   # dir=0(CCW)
                 )
 
             # STOP
@@ -661,9 +780,28 @@ class LayerA_PLC(QWidget):
             self.log(f"Error in process_manual_command: {e}")
 
     # --------------------------
-    # AUTO CYCLE
+    # TICK: đọc thiết bị mỗi READ_INTERVAL_MS, AUTO mỗi AUTO_INTERVAL_MS
+    # --------------------------
+    def _tick(self):
+        self._tick_n += 1
+        n = self._tick_n
+        do_read = n % (READ_INTERVAL_MS // TICK_MS) == 0
+        do_auto = n % (AUTO_INTERVAL_MS // TICK_MS) == 0
+        if not (do_read or do_auto):
+            return
+
+        prev_state = self.motor_state
+        if do_read:
+            self.read_all_devices()
+        if do_auto:
+            self.auto_cycle()
+
+        # IR ghi lại sau mỗi lần đọc, hoặc khi state AUTO đổi
+        if do_read or self.motor_state != prev_state:
+            self.update_input_registers()
+        self.update_ui()
+
     # --------------------------
-        # --------------------------
     # AUTO CYCLE (FIXED – lặp nhiều chu kỳ)
     # --------------------------
     def auto_cycle(self):
@@ -685,35 +823,28 @@ class LayerA_PLC(QWidget):
             except Exception as e:
                 self.log(f"Error reading HR_MODE: {e}")
                 mode = 0
+        self.mode = mode
 
         # ---------- MANUAL MODE ----------
         if mode == 1:
             self.motor_state = "Manual"
             self.process_manual_command()
-            self.update_ui()
-            self.update_input_registers()
             return
 
         # ---------- AUTO MODE ----------
         if not self.auto_enabled:
             self.motor_state = "Disabled"
-            self.update_ui()
-            self.update_input_registers()
             return
 
         if self.driver_alarm:
             if self.motor_state != "Alarm":
                 self.log("AUTO stopped: driver alarm.")
             self.motor_state = "Alarm"
-            self.update_ui()
-            self.update_input_registers()
             return
 
         if self.counter_target <= 0:
             # Chưa được set target từ Layer B/C
             self.motor_state = "Waiting target"
-            self.update_ui()
-            self.update_input_registers()
             return
 
         # ==================================================
@@ -736,8 +867,6 @@ class LayerA_PLC(QWidget):
                 f"run motor +{AUTO_MOVE_PULSES} pulses."
             )
             # Sau khi phát lệnh chạy thì chờ InPos ở vòng kế tiếp
-            self.update_ui()
-            self.update_input_registers()
             return
 
         # ==================================================
@@ -755,8 +884,6 @@ class LayerA_PLC(QWidget):
                 # Quá 10 giây chưa InPos → lỗi timeout
                 self.motor_state = "Timeout motor"
                 self.log("AUTO: timeout waiting for motor InPos.")
-            self.update_ui()
-            self.update_input_registers()
             return
 
         # ==================================================
@@ -767,8 +894,6 @@ class LayerA_PLC(QWidget):
             if self.counter_value == 0 and not self.counter_done:
                 self.motor_state = "Idle"
                 self.log("AUTO: new cycle started (counter reset).")
-            self.update_ui()
-            self.update_input_registers()
             return
 
         # ==================================================
@@ -787,73 +912,58 @@ class LayerA_PLC(QWidget):
             # Đang đếm nhưng chưa DONE
             self.motor_state = "Waiting count"
 
-        self.update_ui()
-        self.update_input_registers()
-
 
     # --------------------------
     # UPDATE UI
     # --------------------------
-    def update_ui(self):
-        self.lbl_temp.setText(f"{self.temperature:.1f} °C")
-        self.lbl_humi.setText(f"{self.humidity:.1f} %")
-
-        if self.sht20_ok:
-            self.lbl_sht_status.setText("SHT20: ONLINE")
-            self.lbl_sht_status.setStyleSheet("font-weight:bold; color:#27ae60;")
-        else:
-            self.lbl_sht_status.setText("SHT20: OFFLINE")
-            self.lbl_sht_status.setStyleSheet("font-weight:bold; color:#c0392b;")
-
-        self.lbl_pos.setText(f"Position: {self.current_position:,} pulse")
-
-        if self.driver_alarm:
-            self.lbl_drv_alarm.setText("Alarm: YES")
-            self.lbl_drv_alarm.setStyleSheet("color:#c0392b; font-weight:bold;")
-        else:
-            self.lbl_drv_alarm.setText("Alarm: NO")
-            self.lbl_drv_alarm.setStyleSheet("color:#27ae60; font-weight:bold;")
-
-        if self.driver_inpos:
-            self.lbl_drv_inpos.setText("InPos: YES")
-            self.lbl_drv_inpos.setStyleSheet("color:#27ae60; font-weight:bold;")
-        else:
-            self.lbl_drv_inpos.setText("InPos: NO")
-            self.lbl_drv_inpos.setStyleSheet("color:#f39c12; font-weight:bold;")
-
-        if self.driver_running:
-            self.lbl_drv_run.setText("Running: YES")
-            self.lbl_drv_run.setStyleSheet("color:#3498db; font-weight:bold;")
-        else:
-            self.lbl_drv_run.setText("Running: NO")
-            self.lbl_drv_run.setStyleSheet("color:#95a5a6; font-weight:bold;")
-
-        self.lbl_counter.setText(f"Counter: {self.counter_value} / {self.counter_target}")
-        if self.counter_done:
-            self.lbl_counter_done.setText("Counter DONE: YES")
-            self.lbl_counter_done.setStyleSheet("color:#27ae60; font-weight:bold;")
-        else:
-            self.lbl_counter_done.setText("Counter DONE: NO")
-            self.lbl_counter_done.setStyleSheet("color:#95a5a6; font-weight:bold;")
-
-        self.lbl_auto_state.setText(f"AUTO STATE: {self.motor_state}")
-        self.lbl_tcp_target.setText(f"TCP Target: {self.last_tcp_target}")
+    def _set(self, label, text, on=None):
+        """setText/đổi property state chỉ khi giá trị hiển thị thay đổi"""
+        value = (text, on)
+        old = self._ui_state.get(label)
+        if old == value:
+            return
+        self._ui_state[label] = value
+        label.setText(text)
+        if on is not None and (old is None or old[1] != on):
+            label.setProperty("state", "on" if on else "off")
+            style = label.style()
+            style.unpolish(label)
+            style.polish(label)
 
-        mode = 0
-        if self.modbus_server:
-            try:
-                m = self.modbus_server.data_bank.get_holding_registers(HR_MODE_ADDR, 1)
-                if m and len(m) >= 1:
-                    mode = m[0]
-            except:
-                pass
+    def update_ui(self):
+        sht_ok = bool(self.sht20_ok)
+        alarm = bool(self.driver_alarm)
+        inpos = bool(self.driver_inpos)
+        running = bool(self.driver_running)
+        done = bool(self.counter_done)
+        manual = self.mode == 1
+
+        items = (
+            (self.lbl_temp, f"{self.temperature:.1f} °C", None),
+            (self.lbl_humi, f"{self.humidity:.1f} %", None),
+            (self.lbl_sht_status, "SHT20: ONLINE" if sht_ok else "SHT20: OFFLINE", sht_ok),
+            (self.lbl_pos, f"Position: {self.current_position:,} pulse", None),
+            (self.lbl_drv_alarm, "Alarm: YES" if alarm else "Alarm: NO", alarm),
+            (self.lbl_drv_inpos, "InPos: YES" if inpos else "InPos: NO", inpos),
+            (self.lbl_drv_run, "Running: YES" if running else "Running: NO", running),
+            (self.lbl_counter, f"Counter: {self.counter_value} / {self.counter_target}", None),
+            (self.lbl_counter_done, "Counter DONE: YES" if done else "Counter DONE: NO", done),
+            (self.lbl_auto_state, f"AUTO STATE: {self.motor_state}", None),
+            (self.lbl_tcp_target, f"TCP Target: {self.last_tcp_target}", None),
+            (self.lbl_mode_info, "MODE: MANUAL" if manual else "MODE: AUTO", manual),
+        )
+        ui_state = self._ui_state
+        changed = [it for it in items if ui_state.get(it[0]) != (it[1], it[2])]
+        if not changed:
+            return
 
-        if mode == 1:
-            self.lbl_mode_info.setText("MODE: MANUAL")
-            self.lbl_mode_info.setStyleSheet("font-size:11pt; font-weight:bold; color:#e67e22;")
-        else:
-            self.lbl_mode_info.setText("MODE: AUTO")
-            self.lbl_mode_info.setStyleSheet("font-size:11pt; font-weight:bold; color:#27ae60;")
+        # Tắt repaint trong lúc set nhiều label → Qt gom thành 1 lần vẽ
+        self.setUpdatesEnabled(False)
+        try:
+            for label, text, on in changed:
+                self._set(label, text, on)
+        finally:
+            self.setUpdatesEnabled(True)
 
     # --------------------------
     # UPDATE INPUT REGISTERS
@@ -896,14 +1006,6 @@ class LayerA_PLC(QWidget):
             }
             auto_code = state_map.get(self.motor_state, 0)
 
-            mode_val = 0
-            try:
-                m = self.modbus_server.data_bank.get_holding_registers(HR_MODE_ADDR, 1)
-                if m and len(m) >= 1:
-                    mode_val = m[0]
-            except:
-                pass
-
             regs = [
                 pos_hi,
                 pos_lo,
@@ -914,7 +1016,7 @@ class LayerA_PLC(QWidget):
                 self.counter_value,
                 self.counter_target,
                 auto_code,
-                mode_val,
+                self.mode,
             ]
             self.modbus_server.data_bank.set_input_registers(0, regs)
         except Exception as e:
@@ -929,26 +1031,19 @@ class LayerA_PLC(QWidget):
                 self.modbus_server = ModbusServer(
                     host="0.0.0.0",
                     port=MODBUS_TCP_PORT,
-                    no_block=True
+                    no_block=True,
+                    data_bank=CmdDataBank(self.signals.cmd_signal.emit)
                 )
+                # DataBank mới đã khởi tạo HR/IR = 0 (TARGET=0, MODE=AUTO, CMD=0)
                 self.modbus_server.start()
 
-                # Init Input Registers & Holding Registers
-                self.modbus_server.data_bank.set_input_registers(0, [0] * 32)
-
-                hr_init = [0] * 100
-                hr_init[HR_TARGET_ADDR] = 0
-                hr_init[HR_MODE_ADDR] = 0
-                hr_init[HR_CMD_ADDR] = 0
-                self.modbus_server.data_bank.set_holding_registers(0, hr_init)
-
                 self.signals.tcp_status_signal.emit(f"Listening on {MODBUS_TCP_PORT}")
-                self.signals.log_signal.emit(f"Modbus TCP Server started on port {MODBUS_TCP_PORT}")
+                self.log(f"Modbus TCP Server started on port {MODBUS_TCP_PORT}")
 
                 while self.running:
                     time.sleep(0.5)
             except Exception as e:
-                self.signals.log_signal.emit(f"Modbus server error: {e}")
+                self.log(f"Modbus server error: {e}")
                 self.signals.tcp_status_signal.emit("Modbus server error")
 
         threading.Thread(target=server_thread, daemon=True).start()
@@ -957,11 +1052,23 @@ class LayerA_PLC(QWidget):
     # HELPERS
     # --------------------------
     def log(self, msg: str):
-        ts = time.strftime("%H:%M:%S")
-        self.log_text.append(f"[{ts}] {msg}")
-
-    def append_log(self, msg: str):
-        self.log(msg)
+        """Đưa log vào hàng đợi (gọi được từ thread bất kỳ)"""
+        sec = int(time.time())
+        last_sec, ts = self._log_ts_cache
+        if sec != last_sec:
+            ts = time.strftime("[%H:%M:%S]", time.localtime(sec))
+            self._log_ts_cache = (sec, ts)
+        self._log_queue.append(f"{ts} {msg}")
+
+    def _flush_logs(self):
+        """Gom các dòng log đang chờ và append lên UI một lần"""
+        queue = self._log_queue
+        if not queue:
+            return
+        batch = []
+        while queue:
+            batch.append(queue.popleft())
+        self.log_text.append("\n".join(batch))
 
     def update_tcp_status(self, text: str):
         self.lbl_tcp_status.setText(text)
@@ -974,8 +1081,7 @@ class LayerA_PLC(QWidget):
 
     def closeEvent(self, event):
         self.running = False
-        self.timer_read.stop()
-        self.timer_auto.stop()
+        self.timer.stop()
 
         if self.ser:
             try:
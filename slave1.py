@@ -26,6 +26,7 @@ Chương trình này chia làm 3 chức năng chính:
 """
 
 import sys, time, struct
+from array import array
 import serial
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QVBoxLayout, QLabel, QHBoxLayout,
@@ -50,6 +51,26 @@ READ_INTERVAL_MS = 500
 # ============================================================================
 # Các hàm hỗ trợ tính toán CRC, đóng gói/giải mã dữ liệu Modbus
 
+# Header request RTU (big-endian) và CRC (little-endian), dùng chung cho các hàm build
+_RTU_HDR = struct.Struct(">BBHH")       # slave, FC, addr/start, value/count
+_RTU_HDR16 = struct.Struct(">BBHHB")    # slave, 0x10, start, count, byte count
+_RTU_CRC = struct.Struct("<H")
+
+def _crc16_table() -> array:
+    """[UTILITY] Bảng CRC16 (poly 0xA001) cho 256 giá trị byte, tạo một lần khi import."""
+    table = array('H')
+    for b in range(256):
+        crc = b
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+CRC16_TABLE = _crc16_table()
+
 def crc16_modbus(data: bytes) -> int:
     """
     [UTILITY] Tính toán Modbus CRC16 cho dữ liệu gói tin thô.
@@ -64,14 +85,10 @@ def crc16_modbus(data: bytes) -> int:
         Giá trị CRC16 dạng số nguyên 16-bit
     """
     crc = 0xFFFF
+    table = CRC16_TABLE
     for b in data:
-        crc ^= b
-        for _ in range(8):
-            if crc & 1:
-                crc = (crc >> 1) ^ 0xA001
-            else:
-                crc >>= 1
-    return crc & 0xFFFF
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
 
 # ============================================================================
 # PHẦN 2: SHT20 SENSOR FUNCTIONS (HÀM CẢMBIẾN SHT20)
@@ -94,13 +111,8 @@ def build_read_sht20(slave_id: int) -> bytes:
     func = 0x04
     reg = 0x0001
     count = 0x0002
-    data = bytes([
-        slave_id, func,
-        (reg >> 8) & 0xFF, reg & 0xFF,
-        (count >> 8) & 0xFF, count & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    data = _RTU_HDR.pack(slave_id & 0xFF, func, reg, count)
+    return data + _RTU_CRC.pack(crc16_modbus(data))
 
 # ============================================================================
 # PHẦN 3: DRIVE CONTROL FUNCTIONS (HÀM ĐIỀU KHIỂN DRIVER)
@@ -123,16 +135,8 @@ def build_fc03(slave_id: int, start_reg: int, count: int) -> bytes:
     Returns:
         Gói tin Modbus FC03 hoàn chỉnh kèm CRC
     """
-    data = bytes([
-        slave_id,
-        0x03,
-        (start_reg >> 8) & 0xFF,
-        start_reg & 0xFF,
-        (count >> 8) & 0xFF,
-        count & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    data = _RTU_HDR.pack(slave_id & 0xFF, 0x03, start_reg & 0xFFFF, count & 0xFFFF)
+    return data + _RTU_CRC.pack(crc16_modbus(data))
 
 def build_fc06(slave_id: int, reg_addr: int, reg_val: int) -> bytes:
     """
@@ -149,16 +153,8 @@ def build_fc06(slave_id: int, reg_addr: int, reg_val: int) -> bytes:
     Returns:
         Gói tin Modbus FC06 hoàn chỉnh kèm CRC
     """
-    data = bytes([
-        slave_id,
-        0x06,
-        (reg_addr >> 8) & 0xFF,
-        reg_addr & 0xFF,
-        (reg_val >> 8) & 0xFF,
-        reg_val & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    data = _RTU_HDR.pack(slave_id & 0xFF, 0x06, reg_addr & 0xFFFF, reg_val & 0xFFFF)
+    return data + _RTU_CRC.pack(crc16_modbus(data))
 
 def build_fc16(slave_id: int, start_reg: int, registers: list) -> bytes:
     """
@@ -176,24 +172,9 @@ def build_fc16(slave_id: int, start_reg: int, registers: list) -> bytes:
         Gói tin Modbus FC16 hoàn chỉnh kèm CRC
     """
     reg_count = len(registers)
-    byte_count = reg_count * 2
-    
-    data = bytearray([
-        slave_id,
-        0x10,
-        (start_reg >> 8) & 0xFF,
-        start_reg & 0xFF,
-        (reg_count >> 8) & 0xFF,
-        reg_count & 0xFF,
-        byte_count
-    ])
-    
-    for reg in registers:
-        data.append((reg >> 8) & 0xFF)
-        data.append(reg & 0xFF)
-    
-    crc = crc16_modbus(bytes(data))
-    return bytes(data) + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    data = _RTU_HDR16.pack(slave_id & 0xFF, 0x10, start_reg & 0xFFFF, reg_count, reg_count * 2)
+    data += struct.pack(f">{reg_count}H", *[reg & 0xFFFF for reg in registers])
+    return data + _RTU_CRC.pack(crc16_modbus(data))
 
 # ============================================================================
 # PHẦN 4: DATA PACKING/UNPACKING UTILITIES
@@ -226,11 +207,7 @@ def pack_s32_to_regs(val: int) -> list:
 
 def unpack_s32_from_bytes(b: bytes, offset: int) -> int:
     """[UTILITY] Unpack signed 32-bit integer from Modbus payload (Big Endian)."""
-    val = (b[offset] << 24) | (b[offset+1] << 16) | (b[offset+2] << 8) | b[offset+3]
-    # Convert to signed
-    if val & 0x80000000:
-        val = val - (1 << 32)
-    return val
+    return int.from_bytes(b[offset:offset + 4], 'big', signed=True)
 
 class SerialWorker(QThread):
     """[UTILITY] Background thread managing raw serial IO for both Driver and SHT20."""
@@ -272,20 +249,22 @@ class SerialWorker(QThread):
             self.ser.flush()
             time.sleep(0.2)  # Tăng delay để đợi ESP32 xử lý
             
-            resp = b""
-            start_time = time.time()
-            while time.time() - start_time < self.timeout:
+            chunks = []
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
                 chunk = self.ser.read(256)
                 if chunk:
-                    resp += chunk
+                    chunks.append(chunk)
                     # Nếu đã có dữ liệu, đợi thêm một chút để nhận hết
                     time.sleep(0.05)
                 else:
-                    if resp:  # Đã có data rồi thì thoát
+                    if chunks:  # Đã có data rồi thì thoát
                         break
                     time.sleep(0.01)
             
-            self.response_received.emit(resp, frame.hex().upper())
+            resp = b"".join(chunks)
+            
+            self.response_received.emit(resp, frame.hex(' ').upper())
             return resp
             
         except Exception as e:
@@ -538,7 +517,7 @@ class DriverGUI(QWidget):
 
     def on_response(self, resp, tx_hex):
         """[GUI] Display latest TX/RX frames for troubleshooting."""
-        rx_hex = resp.hex().upper() if resp else '(timeout)'
+        rx_hex = resp.hex(' ').upper() if resp else '(timeout)'
         self.resp_label.setText(f"TX: {tx_hex}\nRX: {rx_hex}")
 
     def on_error(self, error_msg):
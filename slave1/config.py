@@ -3,6 +3,8 @@
 Cấu hình hệ thống PLC
 """
 
+from enum import IntEnum
+
 # ==========================
 # CẤU HÌNH HỆ THỐNG
 # ==========================
@@ -14,11 +16,38 @@ MODBUS_TCP_PORT = 502
 SERIAL_TIMEOUT = 1.0
 READ_INTERVAL_MS = 300
 
+# Chu kỳ quét từng nhóm thanh ghi (ms): trạng thái driver cần nhanh,
+# nhiệt độ/độ ẩm và counter đổi chậm
+SCAN_TICK_MS = 100
+SCAN_DRIVER_MS = 200
+SCAN_SHT20_MS = 2000
+SCAN_COUNTER_MS = 5000
+AUTO_TEST_INTERVAL_MS = 1000
+
+# Event log (GUI)
+LOG_MAX_LINES = 200
+
 # Slave IDs
 SLAVE_ID_DRIVER = 2
 SLAVE_ID_SHT20 = 1
 SLAVE_ID_COUNTER = 3
 
+# Số thanh ghi đọc từ mỗi thiết bị
+SHT20_REG_COUNT = 2              # FC04 0x0001: temp, humi
+DRIVER_REG_POSITION_COUNT = 2    # FC03 0x1000: position (32-bit)
+DRIVER_REG_STATUS_COUNT = 1      # FC03 0x1010: status word
+COUNTER_REG_COUNT = 4            # FC03 0x0000: value, target, done, reset
+DRIVER_REG_BLOCK_COUNT = 0x11    # FC03 0x1000..0x1010: position + status một lần
+# Số lần đọc gộp thất bại liên tiếp (chưa lần nào thành công) trước khi chuyển hẳn sang đọc riêng
+DRIVER_BLOCK_MAX_FAILS = 3
+
+# Độ dài frame response RTU: addr + func + bytecount + 2*N data + 2 CRC
+FRAME_LEN_SHT20 = 5 + 2 * SHT20_REG_COUNT
+FRAME_LEN_DRIVER_POS = 5 + 2 * DRIVER_REG_POSITION_COUNT
+FRAME_LEN_DRIVER_STATUS = 5 + 2 * DRIVER_REG_STATUS_COUNT
+FRAME_LEN_COUNTER = 5 + 2 * COUNTER_REG_COUNT
+FRAME_LEN_DRIVER_BLOCK = 5 + 2 * DRIVER_REG_BLOCK_COUNT
+
 # Tham số auto chạy motor
 AUTO_MOVE_PULSES = 5000
 AUTO_MOVE_SPEED = 8000
@@ -29,18 +58,24 @@ HR_MODE_ADDR = 8          # 0=AUTO, 1=MANUAL
 HR_CMD_ADDR = 10          # packet lệnh MANUAL từ B/C
 HR_CMD_REG_COUNT = 6      # CMD, POS_HI, POS_LO, SPEED, SOURCE, PRIORITY
 
-# Auto state mapping
-AUTO_STATE_MAP = {
-    "Idle": 0,
-    "Waiting count": 1,
-    "Motor running": 2,
-    "Waiting reset": 3,
-    "Alarm": 4,
-    "Timeout motor": 5,
-    "Disabled": 6,
-    "Waiting target": 7,
-    "Manual": 8,
-}
+# Kích thước vùng thanh ghi của Modbus TCP server
+HR_BANK_SIZE = 100
+IR_BANK_SIZE = 32
+
+# Nhiệt độ/độ ẩm đổi chậm → chỉ tính lại IR temp/humi mỗi N lần cập nhật
+IR_SLOW_FIELD_TICKS = 10
+
+# Trạng thái AUTO; giá trị int = mã ghi vào Input Register
+class MotorState(IntEnum):
+    IDLE = 0
+    WAITING_COUNT = 1
+    MOTOR_RUNNING = 2
+    WAITING_RESET = 3
+    ALARM = 4
+    TIMEOUT_MOTOR = 5
+    DISABLED = 6
+    WAITING_TARGET = 7
+    MANUAL = 8
 
 # UI Colors
 COLOR_CONNECTED = "#27ae60"
@@ -9,11 +9,16 @@ import threading
 
 from modbus_utils import (
     build_fc03, build_fc04, build_fc06, build_fc16,
-    verify_crc, unpack_s32_from_bytes, pack_s32, pack_u32
+    verify_crc, unpack_s32_from_bytes, pack_s32, pack_u32,
+    expected_response_length, response_length_from_header
 )
 from config import (
     SLAVE_ID_DRIVER, SLAVE_ID_SHT20, SLAVE_ID_COUNTER,
-    SERIAL_TIMEOUT
+    SERIAL_TIMEOUT,
+    SHT20_REG_COUNT, DRIVER_REG_POSITION_COUNT, DRIVER_REG_STATUS_COUNT,
+    COUNTER_REG_COUNT, DRIVER_REG_BLOCK_COUNT, DRIVER_BLOCK_MAX_FAILS,
+    FRAME_LEN_SHT20, FRAME_LEN_DRIVER_POS, FRAME_LEN_DRIVER_STATUS,
+    FRAME_LEN_COUNTER, FRAME_LEN_DRIVER_BLOCK
 )
 
 
@@ -24,12 +29,31 @@ class DeviceManager:
         self.ser = None
         self.ser_lock = threading.Lock()
         
+        # Frame request cố định (không đổi giữa các lần poll) → build một lần
+        self._frame_read_pos = build_fc03(SLAVE_ID_DRIVER, 0x1000, DRIVER_REG_POSITION_COUNT)
+        self._frame_read_status = build_fc03(SLAVE_ID_DRIVER, 0x1010, DRIVER_REG_STATUS_COUNT)
+        self._frame_read_driver_block = build_fc03(SLAVE_ID_DRIVER, 0x1000, DRIVER_REG_BLOCK_COUNT)
+        self._frame_read_sht20 = build_fc04(SLAVE_ID_SHT20, 0x0001, SHT20_REG_COUNT)
+        self._frame_read_counter = build_fc03(SLAVE_ID_COUNTER, 0x0000, COUNTER_REG_COUNT)
+        self._frame_reset_counter = build_fc06(SLAVE_ID_COUNTER, 0x0003, 1)
+        self._frame_step_on = build_fc06(SLAVE_ID_DRIVER, 0x0000, 1)
+        self._frame_step_off = build_fc06(SLAVE_ID_DRIVER, 0x0000, 0)
+        self._frame_stop = build_fc06(SLAVE_ID_DRIVER, 0x0002, 1)
+        self._frame_reset_alarm = build_fc06(SLAVE_ID_DRIVER, 0x0001, 1)
+        
+        # Khoảng lặng RTU giữa 2 frame (tính lại khi connect)
+        self._silent_interval = 0.0
+        self._last_frame_end = 0.0
+        
         # Driver state
         self.current_position = 0
         self.current_speed = 0
         self.driver_alarm = False
         self.driver_inpos = False
         self.driver_running = False
+        # None = chưa xác định, False = driver không đọc gộp được 0x1000..0x1010
+        self._driver_block_ok = None
+        self._driver_block_fails = 0
         
         # SHT20
         self.temperature = 0.0
@@ -41,7 +65,7 @@ class DeviceManager:
         self.counter_target = 0
         self.counter_done = False
     
-    def connect(self, port: str, baudrate: int) -> tuple:
+    def connect(self, port: str, baudrate: int, parity: str = serial.PARITY_NONE) -> tuple:
         """
         Kết nối serial port
         Returns: (success: bool, message: str)
@@ -50,7 +74,15 @@ class DeviceManager:
             return False, "Already connected"
         
         try:
-            self.ser = serial.Serial(port, baudrate=baudrate, timeout=SERIAL_TIMEOUT)
+            self.ser = serial.Serial(
+                port, baudrate=baudrate, parity=parity, timeout=SERIAL_TIMEOUT
+            )
+            # 3.5 ký tự (start + data + parity + stop), cố định 1.75 ms khi baud > 19200
+            char_bits = 1 + self.ser.bytesize + (parity != serial.PARITY_NONE) + self.ser.stopbits
+            self._silent_interval = 1.75e-3 if baudrate > 19200 else 3.5 * char_bits / baudrate
+            # Cổng mới có thể là driver khác → thử lại đọc gộp
+            self._driver_block_ok = None
+            self._driver_block_fails = 0
             time.sleep(0.1)
             return True, f"Connected to {port} @ {baudrate}"
         except Exception as e:
@@ -58,12 +90,14 @@ class DeviceManager:
     
     def disconnect(self):
         """Ngắt kết nối serial"""
-        if self.ser:
-            try:
-                self.ser.close()
-            except:
-                pass
-            self.ser = None
+        # Chờ transaction đang chạy (I/O worker) xong rồi mới đóng cổng
+        with self.ser_lock:
+            if self.ser:
+                try:
+                    self.ser.close()
+                except:
+                    pass
+                self.ser = None
     
     def is_connected(self) -> bool:
         """Kiểm tra trạng thái kết nối"""
@@ -76,72 +110,115 @@ class DeviceManager:
         
         with self.ser_lock:
             try:
+                wait = self._last_frame_end + self._silent_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                
                 self.ser.reset_input_buffer()
                 self.ser.write(frame)
                 self.ser.flush()
-                time.sleep(0.02)
                 
-                resp = b""
-                start = time.time()
-                while time.time() - start < SERIAL_TIMEOUT:
-                    chunk = self.ser.read(256)
-                    if chunk:
-                        resp += chunk
-                        time.sleep(0.03)
-                    else:
-                        if resp:
-                            break
-                        time.sleep(0.01)
+                resp = self._read_response(expected_response_length(frame))
+                self._last_frame_end = time.monotonic()
                 return resp
             except Exception as e:
                 print(f"Serial error: {e}")
                 return b""
     
+    def _read_response(self, expected) -> bytes:
+        """Đọc đúng số byte response theo framing RTU (gọi khi đã giữ ser_lock)
+        
+        Độ dài frame lấy từ request (expected) hoặc từ header response, không dựa
+        vào inter_byte_timeout (pyserial trên POSIX bỏ qua giá trị cỡ vài chục ms):
+        mỗi read(n) chỉ dừng khi đủ n byte hoặc hết SERIAL_TIMEOUT.
+        """
+        if expected is None:
+            # Không biết trước: suy độ dài từ addr + func + bytecount
+            head = self.ser.read(3)
+            if len(head) < 3:
+                return head
+            total = response_length_from_header(head)
+            if total is None:
+                return head
+            return head + self.ser.read(total - 3)
+        
+        # 5 byte đầu đủ để nhận ra exception response (func | 0x80)
+        resp = self.ser.read(5)
+        if len(resp) < 5 or resp[1] & 0x80:
+            return resp
+        return resp + self.ser.read(expected - 5)
+    
     def read_driver_position(self) -> bool:
         """Đọc vị trí hiện tại của driver"""
-        frame = build_fc03(SLAVE_ID_DRIVER, 0x1000, 2)
+        frame = self._frame_read_pos
         resp = self.send_frame(frame)
-        if len(resp) >= 9 and resp[1] == 0x03 and verify_crc(resp):
-            try:
-                self.current_position = unpack_s32_from_bytes(resp, 3)
-                return True
-            except:
-                pass
+        if len(resp) == FRAME_LEN_DRIVER_POS and resp[1] == 0x03 and verify_crc(resp):
+            self.current_position = unpack_s32_from_bytes(resp, 3)
+            return True
         return False
     
     def read_driver_status(self) -> bool:
         """Đọc trạng thái driver"""
-        frame = build_fc03(SLAVE_ID_DRIVER, 0x1010, 1)
+        frame = self._frame_read_status
         resp = self.send_frame(frame)
-        if len(resp) >= 7 and resp[1] == 0x03 and verify_crc(resp):
-            sw = (resp[3] << 8) | resp[4]
-            self.driver_alarm = bool((sw >> 8) & 0x01)
-            self.driver_inpos = bool((sw >> 4) & 0x01)
-            self.driver_running = bool((sw >> 2) & 0x01)
+        if len(resp) == FRAME_LEN_DRIVER_STATUS and resp[1] == 0x03 and verify_crc(resp):
+            self._set_driver_status((resp[3] << 8) | resp[4])
             return True
         return False
     
+    def read_driver_block(self) -> bool:
+        """Đọc position (0x1000) và status (0x1010) của driver trong một frame"""
+        if not self.is_connected():
+            return False
+        if self._driver_block_ok is False:
+            ok_pos = self.read_driver_position()
+            ok_status = self.read_driver_status()
+            return ok_pos and ok_status
+        
+        frame = self._frame_read_driver_block
+        resp = self.send_frame(frame)
+        if len(resp) == FRAME_LEN_DRIVER_BLOCK and resp[1] == 0x03 and verify_crc(resp):
+            self._driver_block_ok = True
+            self.current_position = unpack_s32_from_bytes(resp, 3)
+            # HR 0x1010 nằm ở offset 2*0x10 trong vùng data
+            self._set_driver_status((resp[35] << 8) | resp[36])
+            return True
+        
+        if self._driver_block_ok:
+            return False
+        
+        # Chưa lần nào đọc gộp thành công. Driver từ chối (exception response),
+        # hoặc không trả lời / trả frame lỗi nhiều lần liên tiếp → chuyển hẳn sang đọc riêng
+        self._driver_block_fails += 1
+        if ((len(resp) == 5 and resp[1] == 0x83 and verify_crc(resp))
+                or self._driver_block_fails >= DRIVER_BLOCK_MAX_FAILS):
+            self._driver_block_ok = False
+            return self.read_driver_block()
+        return False
+    
+    def _set_driver_status(self, sw: int):
+        """Tách các bit trạng thái từ status word của driver"""
+        self.driver_alarm = bool((sw >> 8) & 0x01)
+        self.driver_inpos = bool((sw >> 4) & 0x01)
+        self.driver_running = bool((sw >> 2) & 0x01)
+    
     def read_sht20(self) -> bool:
         """Đọc cảm biến nhiệt độ và độ ẩm SHT20"""
-        frame = build_fc04(SLAVE_ID_SHT20, 0x0001, 2)
+        frame = self._frame_read_sht20
         resp = self.send_frame(frame)
-        if len(resp) >= 9 and resp[1] == 0x04 and verify_crc(resp):
-            try:
-                self.temperature = ((resp[3] << 8) | resp[4]) / 10.0
-                self.humidity = ((resp[5] << 8) | resp[6]) / 10.0
-                self.sht20_ok = True
-                return True
-            except:
-                self.sht20_ok = False
-        else:
-            self.sht20_ok = False
+        if len(resp) == FRAME_LEN_SHT20 and resp[1] == 0x04 and verify_crc(resp):
+            self.temperature = ((resp[3] << 8) | resp[4]) / 10.0
+            self.humidity = ((resp[5] << 8) | resp[6]) / 10.0
+            self.sht20_ok = True
+            return True
+        self.sht20_ok = False
         return False
     
     def read_counter(self) -> bool:
         """Đọc counter Arduino"""
-        frame = build_fc03(SLAVE_ID_COUNTER, 0x0000, 4)
+        frame = self._frame_read_counter
         resp = self.send_frame(frame)
-        if len(resp) >= 13 and resp[1] == 0x03 and verify_crc(resp):
+        if len(resp) == FRAME_LEN_COUNTER and resp[1] == 0x03 and verify_crc(resp):
             hr0 = (resp[3] << 8) | resp[4]
             hr1 = (resp[5] << 8) | resp[6]
             hr2 = (resp[7] << 8) | resp[8]
@@ -153,12 +230,8 @@ class DeviceManager:
     
     def read_all_devices(self):
         """Đọc tất cả thiết bị"""
-        self.read_driver_position()
-        time.sleep(0.01)
-        self.read_driver_status()
-        time.sleep(0.01)
+        self.read_driver_block()
         self.read_sht20()
-        time.sleep(0.01)
         self.read_counter()
     
     def set_counter_target(self, target: int) -> bool:
@@ -169,19 +242,19 @@ class DeviceManager:
     
     def reset_counter(self) -> bool:
         """Reset counter Arduino (HR3 = 1)"""
-        frame = build_fc06(SLAVE_ID_COUNTER, 0x0003, 1)
+        frame = self._frame_reset_counter
         resp = self.send_frame(frame)
         return resp and len(resp) >= 8
     
     def motor_step_on(self) -> bool:
         """Bật motor step"""
-        frame = build_fc06(SLAVE_ID_DRIVER, 0x0000, 1)
+        frame = self._frame_step_on
         resp = self.send_frame(frame)
         return bool(resp)
     
     def motor_step_off(self) -> bool:
         """Tắt motor step"""
-        frame = build_fc06(SLAVE_ID_DRIVER, 0x0000, 0)
+        frame = self._frame_step_off
         resp = self.send_frame(frame)
         return bool(resp)
     
@@ -210,7 +283,7 @@ class DeviceManager:
         frame = build_fc16(
             SLAVE_ID_DRIVER,
             0x0030,
-            pack_u32(speed) + [0, 1]  # dir=1 (CW)
+            pack_u32(speed) + (0, 1)  # dir=1 (CW)
         )
         resp = self.send_frame(frame)
         return bool(resp)
@@ -225,19 +298,19 @@ class DeviceManager:
         frame = build_fc16(
             SLAVE_ID_DRIVER,
             0x0030,
-            pack_u32(speed) + [0, 0]  # dir=0 (CCW)
+            pack_u32(speed) + (0, 0)  # dir=0 (CCW)
         )
         resp = self.send_frame(frame)
         return bool(resp)
     
     def motor_stop(self) -> bool:
         """Dừng motor"""
-        frame = build_fc06(SLAVE_ID_DRIVER, 0x0002, 1)
+        frame = self._frame_stop
         resp = self.send_frame(frame)
         return bool(resp)
     
     def motor_reset_alarm(self) -> bool:
         """Reset alarm của driver"""
-        frame = build_fc06(SLAVE_ID_DRIVER, 0x0001, 1)
+        frame = self._frame_reset_alarm
         resp = self.send_frame(frame)
         return bool(resp)
\ No newline at end of file
@@ -6,31 +6,169 @@ GUI giống hình ảnh mô tả
 
 import sys
 import time
+from collections import deque
+from serial.tools import list_ports
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QComboBox, QGroupBox, QGridLayout, QTextEdit, QFrame, QSpinBox, QCheckBox
 )
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject
-from PyQt5.QtGui import QFont, QPalette, QColor
+from PyQt5.QtCore import Qt, QThread, QThreadPool, QRunnable, pyqtSignal, QObject
+from PyQt5.QtGui import QFont, QPalette, QColor, QTextCursor
 
 from config import (
     COLOR_CONNECTED, COLOR_DISCONNECTED, COLOR_ERROR,
-    COLOR_WARNING, COLOR_INFO, COLOR_NEUTRAL
+    COLOR_WARNING, COLOR_INFO, COLOR_NEUTRAL, LOG_MAX_LINES,
+    SCAN_TICK_MS, SCAN_DRIVER_MS, SCAN_SHT20_MS, SCAN_COUNTER_MS,
+    AUTO_TEST_INTERVAL_MS
 )
 from device_manager import DeviceManager
 from plc_controller import PLCController
 
 
+# Stylesheet cho các label trạng thái (tạo một lần, dùng lại)
+_STYLE_OK = f"font-weight: bold; color: {COLOR_CONNECTED};"
+_STYLE_BAD = "font-weight: bold; color: #e74c3c;"
+_STYLE_ERROR = f"font-weight: bold; color: {COLOR_ERROR};"
+_STYLE_WARNING = f"font-weight: bold; color: {COLOR_WARNING};"
+_STYLE_INFO = f"font-weight: bold; color: {COLOR_INFO};"
+_STYLE_IDLE = f"font-weight: bold; color: {COLOR_NEUTRAL};"
+
+# (text, style) theo trạng thái: LUT[False], LUT[True]
+_ONLINE_LUT = (("OFFLINE", _STYLE_BAD), ("ONLINE", _STYLE_OK))
+_ALARM_LUT = (("NO", _STYLE_OK), ("YES", _STYLE_ERROR))
+_INPOS_LUT = (("NO", _STYLE_WARNING), ("YES", _STYLE_OK))
+_RUN_LUT = (("NO", _STYLE_IDLE), ("YES", _STYLE_INFO))
+_MASTER_LUT = (("NO", _STYLE_BAD), ("YES", _STYLE_OK))
+
+
 class SignalEmitter(QObject):
     """Signal emitter để giao tiếp giữa thread và UI"""
     log_signal = pyqtSignal(str)
-    tcp_status_signal = pyqtSignal(str)
+    log_ready = pyqtSignal()
     serial_status_signal = pyqtSignal(str)
+    master_clients_signal = pyqtSignal(int)  # số master TCP đang kết nối
+    export_done = pyqtSignal(bool, str)  # (thành công, tên file hoặc lỗi)
+
+
+class _ExportJob(QRunnable):
+    """Ghi log ra file trên QThreadPool, báo kết quả qua signal"""
+    
+    def __init__(self, text, path, done_sig):
+        super().__init__()
+        self.text = text
+        self.path = path
+        self.done_sig = done_sig
+    
+    def run(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(self.text)
+            self.done_sig.emit(True, self.path)
+        except Exception as e:
+            self.done_sig.emit(False, str(e))
+
+
+class DeviceIOWorker(QObject):
+    """Đọc thiết bị RS485 trên QThread riêng, phát giá trị mới về UI"""
+    # (sht20_ok, temp, humi, pos, alarm, inpos, running) - chỉ phát khi đổi
+    sample = pyqtSignal(tuple)
+    # Kết quả auto test (các dòng "<thiết bị>: OK/FAILED")
+    test_result = pyqtSignal(list)
+    finished = pyqtSignal()
+    
+    def __init__(self, device_manager, interval_ms=SCAN_TICK_MS):
+        super().__init__()
+        self.device_manager = device_manager
+        self.interval_ms = interval_ms
+        self._run = True
+        self._last_sample = None
+        self._auto_test = False
+        self._next_test = 0.0
+        
+        # Mỗi nhóm thanh ghi một chu kỳ riêng [interval_ms, reader, last_ms]
+        dm = device_manager
+        self._scan = [
+            [SCAN_DRIVER_MS, dm.read_driver_block, 0.0],
+            [SCAN_SHT20_MS, dm.read_sht20, 0.0],
+            [SCAN_COUNTER_MS, dm.read_counter, 0.0],
+        ]
+        self._scan_next = 0
+        # Kết quả lần đọc gần nhất của từng nhóm (driver, sht20, counter)
+        self._read_ok = [False] * len(self._scan)
+    
+    def run(self):
+        """Vòng lặp I/O (chạy trong QThread)"""
+        dm = self.device_manager
+        while self._run:
+            if dm.is_connected():
+                self.scan_devices()
+                sample = (
+                    dm.sht20_ok, dm.temperature, dm.humidity, dm.current_position,
+                    dm.driver_alarm, dm.driver_inpos, dm.driver_running
+                )
+                if sample != self._last_sample:
+                    self._last_sample = sample
+                    self.sample.emit(sample)
+                if self._auto_test:
+                    self._emit_test_result()
+            QThread.msleep(self.interval_ms)
+        self.finished.emit()
+    
+    def reset(self):
+        """Chuẩn bị chạy lại sau khi kết nối (gọi trước khi start thread)"""
+        self._run = True
+        self._last_sample = None
+        for entry in self._scan:
+            entry[2] = 0.0
+    
+    def stop(self):
+        """Yêu cầu dừng vòng lặp (gọi từ GUI thread)"""
+        self._run = False
+    
+    def set_auto_test(self, enabled: bool):
+        """Bật/tắt auto test (gọi từ GUI thread)"""
+        self._next_test = 0.0
+        self._auto_test = enabled
+    
+    def _emit_test_result(self):
+        """Phát kết quả test từ các lần đọc đã có (không I/O thêm)"""
+        now = time.monotonic() * 1000.0
+        if now < self._next_test:
+            return
+        self._next_test = now + AUTO_TEST_INTERVAL_MS
+        driver_ok, sht20_ok, counter_ok = self._read_ok
+        self.test_result.emit([
+            f"SHT20: {'OK' if sht20_ok else 'FAILED'}",
+            f"Driver Position: {'OK' if driver_ok else 'FAILED'}",
+            f"Driver Status: {'OK' if driver_ok else 'FAILED'}",
+            f"Counter: {'OK' if counter_ok else 'FAILED'}",
+        ])
+    
+    def scan_devices(self):
+        """Đọc nhóm thanh ghi đã tới hạn (tối đa một request mỗi vòng, xoay vòng)"""
+        scan = self._scan
+        n = len(scan)
+        now = time.monotonic() * 1000.0
+        for i in range(n):
+            k = (self._scan_next + i) % n
+            entry = scan[k]
+            if now - entry[2] >= entry[0]:
+                entry[2] = now
+                self._scan_next = (k + 1) % n
+                self._read_ok[k] = entry[1]()
+                return
 
 
 class SlaveLayerGUI(QWidget):
     """GUI chính của Slave Layer"""
     
+    # Combo parity → ký tự parity của pyserial
+    _PARITY_MAP = {"Even (E)": "E", "Odd (O)": "O", "None (N)": "N"}
+    
+    # QSS đã tạo theo tham số (border_color) / (bg_color, large)
+    _GROUPBOX_STYLE_CACHE: dict = {}
+    _BUTTON_STYLE_CACHE: dict = {}
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("SLAVE LAYER - Device Connection Tester + Modbus Server")
@@ -45,13 +183,32 @@ class SlaveLayerGUI(QWidget):
         
         # Signals
         self.signals = SignalEmitter()
-        self.signals.log_signal.connect(self.append_log)
-        self.signals.tcp_status_signal.connect(self.update_tcp_status)
+        # log() chỉ đưa dòng vào _pending_logs; flush_log vẽ cả lô một lần
+        self.signals.log_signal.connect(self.log, Qt.QueuedConnection)
+        # Queued: flush_log luôn chạy trên GUI thread, gộp các log phát sinh liên tiếp
+        self.signals.log_ready.connect(self.flush_log, Qt.QueuedConnection)
         self.signals.serial_status_signal.connect(self.update_serial_status)
+        self.signals.master_clients_signal.connect(
+            self.update_master_connected, Qt.QueuedConnection
+        )
+        self.signals.export_done.connect(self._on_export_done, Qt.QueuedConnection)
         
         # Auto test flag
         self.auto_test_running = False
-        self.auto_test_timer = None
+        
+        # Log chờ hiển thị, được đẩy lên UI theo lô qua signal log_ready.
+        # deque append/popleft an toàn khi log() được gọi từ thread Modbus server
+        self._pending_logs = deque()
+        self._flush_pending = False
+        # Bản sao các dòng đang hiển thị (tự bỏ dòng cũ như QTextEdit)
+        self._log_buf = deque(maxlen=LOG_MAX_LINES)
+        self._last_line_count = 0  # số dòng đang hiện trên lbl_line_count
+        self._log_ts_cache = (0, "")  # (giây, "[HH:MM:SS]") của dòng log gần nhất
+        
+        # Tin status gần nhất từ Modbus server (bỏ tin trùng liên tiếp)
+        self._last_tcp_status = None
+        # (text, style) đã set cho từng label
+        self._label_cache = {}
         
         # Build UI
         self._build_ui()
@@ -60,10 +217,14 @@ class SlaveLayerGUI(QWidget):
         self.log("SLAVE LAYER - MODBUS TCP SERVER initialized.")
         self.log("Device tester + Modbus TCP Server for Master connection")
         
-        # Start update timer
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_device_status)
-        self.timer.start(1000)  # Update every second
+        # Quét thiết bị trên QThread riêng; GUI chỉ hiển thị sample nhận được.
+        # Thread chỉ chạy khi RS485 đã kết nối (_start_io / _stop_io)
+        self._io_thread = QThread()
+        self._worker = DeviceIOWorker(self.device_manager)
+        self._worker.moveToThread(self._io_thread)
+        self._worker.sample.connect(self._apply_sample, Qt.QueuedConnection)
+        self._worker.test_result.connect(self._log_test_result, Qt.QueuedConnection)
+        self._io_thread.started.connect(self._worker.run)
     
     def _build_ui(self):
         """Xây dựng giao diện"""
@@ -139,22 +300,22 @@ class SlaveLayerGUI(QWidget):
         # Server info
         layout.addWidget(QLabel("Server Address:"), 0, 0)
         self.lbl_server_addr = QLabel("192.168.1.220")
-        self.lbl_server_addr.setStyleSheet("font-weight: bold; color: #3498db;")
+        self.lbl_server_addr.setStyleSheet(_STYLE_INFO)
         layout.addWidget(self.lbl_server_addr, 0, 1)
         
         layout.addWidget(QLabel("Port:"), 1, 0)
         self.lbl_server_port = QLabel("502")
-        self.lbl_server_port.setStyleSheet("font-weight: bold; color: #3498db;")
+        self.lbl_server_port.setStyleSheet(_STYLE_INFO)
         layout.addWidget(self.lbl_server_port, 1, 1)
         
         layout.addWidget(QLabel("Status:"), 2, 0)
         self.lbl_tcp_status = QLabel("STOPPED")
-        self.lbl_tcp_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_tcp_status.setStyleSheet(_STYLE_BAD)
         layout.addWidget(self.lbl_tcp_status, 2, 1)
         
         layout.addWidget(QLabel("Master Connected:"), 3, 0)
         self.lbl_master_connected = QLabel("NO")
-        self.lbl_master_connected.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_master_connected.setStyleSheet(_STYLE_BAD)
         layout.addWidget(self.lbl_master_connected, 3, 1)
         
         # Buttons
@@ -187,10 +348,14 @@ class SlaveLayerGUI(QWidget):
         # Port selection
         layout.addWidget(QLabel("Port:"), 0, 0)
         self.combo_port = QComboBox()
-        self.combo_port.addItems(["COM11", "COM3", "COM14", "COM5", "COM6", "COM7", "COM8", "COM9"])
-        self.combo_port.setCurrentText("COM11")
         layout.addWidget(self.combo_port, 0, 1)
         
+        self.btn_refresh_ports = QPushButton("REFRESH")
+        self.btn_refresh_ports.setStyleSheet(self._get_button_style("#7f8c8d"))
+        self.btn_refresh_ports.clicked.connect(self.refresh_ports)
+        layout.addWidget(self.btn_refresh_ports, 0, 2)
+        self.refresh_ports()
+        
         # Baudrate
         layout.addWidget(QLabel("Baudrate:"), 1, 0)
         self.combo_baud = QComboBox()
@@ -202,13 +367,14 @@ class SlaveLayerGUI(QWidget):
         layout.addWidget(QLabel("Parity:"), 2, 0)
         self.combo_parity = QComboBox()
         self.combo_parity.addItems(["Even (E)", "Odd (O)", "None (N)"])
-        self.combo_parity.setCurrentText("Even (E)")
+        # Mặc định 8N1 như trước khi combo parity được dùng
+        self.combo_parity.setCurrentText("None (N)")
         layout.addWidget(self.combo_parity, 2, 1)
         
         # Status
         layout.addWidget(QLabel("Status:"), 3, 0)
         self.lbl_serial_status = QLabel("DISCONNECTED")
-        self.lbl_serial_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_serial_status.setStyleSheet(_STYLE_BAD)
         layout.addWidget(self.lbl_serial_status, 3, 1)
         
         # Buttons
@@ -225,7 +391,7 @@ class SlaveLayerGUI(QWidget):
         self.btn_disconnect.setEnabled(False)
         btn_layout.addWidget(self.btn_disconnect)
         
-        layout.addLayout(btn_layout, 4, 0, 1, 2)
+        layout.addLayout(btn_layout, 4, 0, 1, 3)
         
         group.setLayout(layout)
         return group
@@ -241,23 +407,23 @@ class SlaveLayerGUI(QWidget):
         # SHT20 Sensor
         layout.addWidget(QLabel("SHT20 Sensor:"), 0, 0)
         self.lbl_sht20_status = QLabel("OFFLINE")
-        self.lbl_sht20_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_sht20_status.setStyleSheet(_STYLE_BAD)
         layout.addWidget(self.lbl_sht20_status, 0, 1)
         
         layout.addWidget(QLabel("Temp:"), 0, 2)
         self.lbl_temp = QLabel("--.-°C")
-        self.lbl_temp.setStyleSheet("font-weight: bold; color: #3498db;")
+        self.lbl_temp.setStyleSheet(_STYLE_INFO)
         layout.addWidget(self.lbl_temp, 0, 3)
         
         layout.addWidget(QLabel("Humi:"), 0, 4)
         self.lbl_humi = QLabel("--.-%")
-        self.lbl_humi.setStyleSheet("font-weight: bold; color: #3498db;")
+        self.lbl_humi.setStyleSheet(_STYLE_INFO)
         layout.addWidget(self.lbl_humi, 0, 5)
         
         # Motor Driver
         layout.addWidget(QLabel("Motor Driver:"), 1, 0)
         self.lbl_motor_status = QLabel("OFFLINE")
-        self.lbl_motor_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_motor_status.setStyleSheet(_STYLE_BAD)
         layout.addWidget(self.lbl_motor_status, 1, 1)
         
         layout.addWidget(QLabel("Position:"), 1, 2)
@@ -267,17 +433,17 @@ class SlaveLayerGUI(QWidget):
         
         layout.addWidget(QLabel("Alarm:"), 2, 0)
         self.lbl_alarm = QLabel("-")
-        self.lbl_alarm.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_alarm.setStyleSheet(_STYLE_BAD)
         layout.addWidget(self.lbl_alarm, 2, 1)
         
         layout.addWidget(QLabel("InPos:"), 2, 2)
         self.lbl_inpos = QLabel("-")
-        self.lbl_inpos.setStyleSheet("font-weight: bold; color: #e67e22;")
+        self.lbl_inpos.setStyleSheet(_STYLE_WARNING)
         layout.addWidget(self.lbl_inpos, 2, 3)
         
         layout.addWidget(QLabel("Run:"), 2, 4)
         self.lbl_run = QLabel("-")
-        self.lbl_run.setStyleSheet("font-weight: bold; color: #95a5a6;")
+        self.lbl_run.setStyleSheet(_STYLE_IDLE)
         layout.addWidget(self.lbl_run, 2, 5)
         
         group.setLayout(layout)
@@ -306,7 +472,7 @@ class SlaveLayerGUI(QWidget):
         auto_layout.addWidget(self.btn_auto_test)
         
         self.lbl_auto_test_status = QLabel("OFF")
-        self.lbl_auto_test_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self.lbl_auto_test_status.setStyleSheet(_STYLE_BAD)
         auto_layout.addWidget(self.lbl_auto_test_status)
         
         layout.addLayout(auto_layout)
@@ -326,6 +492,8 @@ class SlaveLayerGUI(QWidget):
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setMaximumHeight(200)
+        # Qt tự bỏ các dòng cũ khi vượt quá giới hạn
+        self.log_text.document().setMaximumBlockCount(LOG_MAX_LINES)
         self.log_text.setStyleSheet("""
             background: #2c3e50;
             color: #ecf0f1;
@@ -352,7 +520,7 @@ class SlaveLayerGUI(QWidget):
         
         # Line counter
         control_layout.addStretch()
-        self.lbl_line_count = QLabel("Lines: 0 / 200")
+        self.lbl_line_count = QLabel(f"Lines: 0 / {LOG_MAX_LINES}")
         self.lbl_line_count.setStyleSheet("color: #7f8c8d; font-weight: bold;")
         control_layout.addWidget(self.lbl_line_count)
         
@@ -361,10 +529,14 @@ class SlaveLayerGUI(QWidget):
         group.setLayout(layout)
         return group
     
-    @staticmethod
-    def _get_groupbox_style(border_color):
+    @classmethod
+    def _get_groupbox_style(cls, border_color):
         """Style cho QGroupBox"""
-        return f"""
+        s = cls._GROUPBOX_STYLE_CACHE.get(border_color)
+        if s is not None:
+            return s
+        
+        s = cls._GROUPBOX_STYLE_CACHE[border_color] = f"""
             QGroupBox {{
                 font-weight: bold;
                 font-size: 12pt;
@@ -381,14 +553,20 @@ class SlaveLayerGUI(QWidget):
                 background-color: white;
             }}
         """
+        return s
     
-    @staticmethod
-    def _get_button_style(bg_color, large=False):
+    @classmethod
+    def _get_button_style(cls, bg_color, large=False):
         """Style cho button"""
+        key = (bg_color, large)
+        s = cls._BUTTON_STYLE_CACHE.get(key)
+        if s is not None:
+            return s
+        
         size = "padding: 12px 20px;" if large else "padding: 8px 15px;"
         font = "font-size: 11pt;" if large else "font-size: 10pt;"
         
-        return f"""
+        s = cls._BUTTON_STYLE_CACHE[key] = f"""
             QPushButton {{
                 background: {bg_color};
                 color: white;
@@ -406,91 +584,131 @@ class SlaveLayerGUI(QWidget):
                 color: #bdc3c7;
             }}
         """
+        return s
     
     def log(self, msg: str):
         """Ghi log"""
-        ts = time.strftime("[%H:%M:%S]")
-        full_msg = f"{ts} {msg}"
-        self.log_text.append(full_msg)
-        
-        # Update line count
-        lines = self.log_text.toPlainText().count('\n') + 1
-        self.lbl_line_count.setText(f"Lines: {lines} / 200")
-        
-        # Limit log size
-        if lines > 200:
-            text = self.log_text.toPlainText()
-            lines_list = text.split('\n')
-            self.log_text.setPlainText('\n'.join(lines_list[-200:]))
+        sec = int(time.time())
+        last_sec, ts = self._log_ts_cache
+        if sec != last_sec:
+            ts = time.strftime("[%H:%M:%S]", time.localtime(sec))
+            self._log_ts_cache = (sec, ts)
+        self._pending_logs.append(f"{ts} {msg}")
+        if not self._flush_pending:
+            self._flush_pending = True
+            self.signals.log_ready.emit()
+    
+    def flush_log(self):
+        """Append các dòng log mới lên UI (khi có log mới)"""
+        self._flush_pending = False
+        pending = self._pending_logs
+        if not pending:
+            return
+        batch = []
+        while pending:
+            batch.append(pending.popleft())
+        self._log_buf.extend(batch)
+        # Chèn plain text ở cuối document (append() dò rich text trên mỗi chuỗi);
+        # document tự bỏ block cũ theo setMaximumBlockCount
+        doc = self.log_text.document()
+        cursor = QTextCursor(doc)
+        cursor.movePosition(QTextCursor.End)
+        if not doc.isEmpty():
+            cursor.insertBlock()
+        cursor.insertText("\n".join(batch))
+        sb = self.log_text.verticalScrollBar()
+        sb.setValue(sb.maximum())
+        self._update_line_count()
+    
+    def _update_line_count(self):
+        """Cập nhật label số dòng log (chỉ khi số dòng đổi)"""
+        count = len(self._log_buf)
+        if count != self._last_line_count:
+            self._last_line_count = count
+            self.lbl_line_count.setText(f"Lines: {count} / {self._log_buf.maxlen}")
     
-    def append_log(self, msg: str):
-        """Append log từ signal"""
-        self.log(msg)
+    def _post_tcp_status(self, msg: str):
+        """Cập nhật TCP status (gọi từ mọi thread), bỏ qua tin trùng tin trước"""
+        if msg == self._last_tcp_status:
+            return
+        self._last_tcp_status = msg
+        # update_tcp_status chỉ ghi log() → đã gộp theo lô qua log_ready
+        self.update_tcp_status(msg)
     
     def clear_log(self):
         """Xóa log"""
+        self._pending_logs.clear()
+        self._log_buf.clear()
         self.log_text.clear()
-        self.lbl_line_count.setText("Lines: 0 / 200")
+        self._update_line_count()
     
     def export_log(self):
         """Export log to file"""
-        try:
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            filename = f"slave_layer_log_{timestamp}.txt"
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(self.log_text.toPlainText())
-            
-            self.log(f"Log exported to {filename}")
-        except Exception as e:
-            self.log(f"Error exporting log: {e}")
+        self.flush_log()
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        filename = f"slave_layer_log_{timestamp}.txt"
+        
+        # Chụp nội dung trên GUI thread, ghi file trên thread pool
+        text = "\n".join(self._log_buf)
+        QThreadPool.globalInstance().start(
+            _ExportJob(text, filename, self.signals.export_done)
+        )
     
-    def update_device_status(self):
-        """Cập nhật trạng thái thiết bị"""
-        if not self.device_manager.is_connected():
+    def _on_export_done(self, ok: bool, info: str):
+        """Kết quả export log từ _ExportJob"""
+        if ok:
+            self.log(f"Log exported to {info}")
+        else:
+            self.log(f"Error exporting log: {info}")
+    
+    def _set(self, lbl, text, style=None):
+        """setText/setStyleSheet chỉ khi khác giá trị đã set lần trước"""
+        value = (text, style)
+        if self._label_cache.get(lbl) == value:
             return
-        
-        # Đọc tất cả thiết bị
-        self.device_manager.read_all_devices()
-        
-        # Cập nhật UI
-        dm = self.device_manager
+        self._label_cache[lbl] = value
+        lbl.setText(text)
+        if style is not None:
+            lbl.setStyleSheet(style)
+    
+    def _apply_sample(self, sample: tuple):
+        """Cập nhật trạng thái thiết bị từ sample của DeviceIOWorker (không I/O)"""
+        # Tắt repaint trong lúc set nhiều label → Qt gom thành 1 lần vẽ
+        self.setUpdatesEnabled(False)
+        try:
+            self._render_sample(sample)
+        finally:
+            self.setUpdatesEnabled(True)
+    
+    def _render_sample(self, sample: tuple):
+        """Set các label trạng thái thiết bị theo sample"""
+        sht20_ok, temp, humi, pos, alarm, inpos, running = sample
         
         # SHT20
-        if dm.sht20_ok:
-            self.lbl_sht20_status.setText("ONLINE")
-            self.lbl_sht20_status.setStyleSheet("font-weight: bold; color: #27ae60;")
-            self.lbl_temp.setText(f"{dm.temperature:.1f}°C")
-            self.lbl_humi.setText(f"{dm.humidity:.1f}%")
+        self._set(self.lbl_sht20_status, *_ONLINE_LUT[bool(sht20_ok)])
+        if sht20_ok:
+            self._set(self.lbl_temp, f"{temp:.1f}°C")
+            self._set(self.lbl_humi, f"{humi:.1f}%")
         else:
-            self.lbl_sht20_status.setText("OFFLINE")
-            self.lbl_sht20_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
-            self.lbl_temp.setText("--.-°C")
-            self.lbl_humi.setText("--.-%")
+            self._set(self.lbl_temp, "--.-°C")
+            self._set(self.lbl_humi, "--.-%")
         
         # Motor Driver
-        if any([dm.driver_alarm, dm.driver_inpos, dm.driver_running]):
-            self.lbl_motor_status.setText("ONLINE")
-            self.lbl_motor_status.setStyleSheet("font-weight: bold; color: #27ae60;")
-        else:
-            self.lbl_motor_status.setText("OFFLINE")
-            self.lbl_motor_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self._set(self.lbl_motor_status, *_ONLINE_LUT[bool(alarm or inpos or running)])
         
-        self.lbl_position.setText(f"{dm.current_position:,} pulse")
-        self.lbl_alarm.setText("YES" if dm.driver_alarm else "NO")
-        self.lbl_inpos.setText("YES" if dm.driver_inpos else "NO")
-        self.lbl_run.setText("YES" if dm.driver_running else "NO")
-        
-        # Update colors based on status
-        self.lbl_alarm.setStyleSheet(
-            f"font-weight: bold; color: {COLOR_ERROR if dm.driver_alarm else COLOR_CONNECTED};"
-        )
-        self.lbl_inpos.setStyleSheet(
-            f"font-weight: bold; color: {COLOR_CONNECTED if dm.driver_inpos else COLOR_WARNING};"
-        )
-        self.lbl_run.setStyleSheet(
-            f"font-weight: bold; color: {COLOR_INFO if dm.driver_running else COLOR_NEUTRAL};"
-        )
+        self._set(self.lbl_position, f"{pos:,} pulse")
+        self._set(self.lbl_alarm, *_ALARM_LUT[bool(alarm)])
+        self._set(self.lbl_inpos, *_INPOS_LUT[bool(inpos)])
+        self._set(self.lbl_run, *_RUN_LUT[bool(running)])
+    
+    def refresh_ports(self):
+        """Liệt kê các cổng serial đang có (giữ cổng đang chọn nếu còn)"""
+        current = self.combo_port.currentText() or "COM11"
+        ports = sorted(p.device for p in list_ports.comports())
+        self.combo_port.clear()
+        self.combo_port.addItems(ports)
+        if current in ports:
+            self.combo_port.setCurrentText(current)
     
     def connect_serial(self):
         """Kết nối serial"""
@@ -499,36 +717,54 @@ class SlaveLayerGUI(QWidget):
             return
         
         port = self.combo_port.currentText()
+        if not port:
+            self.log("No serial port available")
+            return
         baud = int(self.combo_baud.currentText())
+        parity = self._PARITY_MAP[self.combo_parity.currentText()]
         
-        success, message = self.device_manager.connect(port, baud)
+        success, message = self.device_manager.connect(port, baud, parity)
         
         if success:
-            self.lbl_serial_status.setText("CONNECTED")
-            self.lbl_serial_status.setStyleSheet("font-weight: bold; color: #27ae60;")
+            self._set(self.lbl_serial_status, "CONNECTED", _STYLE_OK)
             self.btn_connect.setEnabled(False)
             self.btn_disconnect.setEnabled(True)
-            self.log(f"RS485 connected to {port} @ {baud} baud")
+            self.log(f"RS485 connected to {port} @ {baud} baud, parity {parity}")
+            self._start_io()
         else:
             self.log(f"RS485 connection error: {message}")
     
+    def _start_io(self):
+        """Bắt đầu quét thiết bị trên I/O thread"""
+        if not self._io_thread.isRunning():
+            self._worker.reset()
+            self._io_thread.start()
+    
+    def _stop_io(self):
+        """Dừng I/O thread và chờ transaction đang chạy kết thúc"""
+        if self._io_thread.isRunning():
+            self._worker.stop()
+            self._io_thread.quit()
+            self._io_thread.wait()
+    
     def disconnect_serial(self):
         """Ngắt kết nối serial"""
+        self._stop_io()
         self.device_manager.disconnect()
-        self.lbl_serial_status.setText("DISCONNECTED")
-        self.lbl_serial_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self._set(self.lbl_serial_status, "DISCONNECTED", _STYLE_BAD)
         self.btn_connect.setEnabled(True)
         self.btn_disconnect.setEnabled(False)
         self.log("RS485 disconnected")
     
     def start_modbus_server(self):
         """Khởi động Modbus TCP Server"""
+        self._last_tcp_status = None
         try:
             self.plc_controller.start_modbus_server(
-                status_callback=lambda msg: self.signals.tcp_status_signal.emit(msg)
+                status_callback=self._post_tcp_status,
+                clients_callback=self.signals.master_clients_signal.emit
             )
-            self.lbl_tcp_status.setText("RUNNING")
-            self.lbl_tcp_status.setStyleSheet("font-weight: bold; color: #27ae60;")
+            self._set(self.lbl_tcp_status, "RUNNING", _STYLE_OK)
             self.btn_start_server.setEnabled(False)
             self.btn_stop_server.setEnabled(True)
             self.log("Modbus TCP Server started")
@@ -538,8 +774,8 @@ class SlaveLayerGUI(QWidget):
     def stop_modbus_server(self):
         """Dừng Modbus TCP Server"""
         self.plc_controller.stop_modbus_server()
-        self.lbl_tcp_status.setText("STOPPED")
-        self.lbl_tcp_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+        self._set(self.lbl_tcp_status, "STOPPED", _STYLE_BAD)
+        self.update_master_connected(0)
         self.btn_start_server.setEnabled(True)
         self.btn_stop_server.setEnabled(False)
         self.log("Modbus TCP Server stopped")
@@ -580,6 +816,10 @@ class SlaveLayerGUI(QWidget):
             results.append("Counter: FAILED")
         
         # Hiển thị kết quả
+        self._log_test_result(results)
+    
+    def _log_test_result(self, results: list):
+        """Ghi kết quả test thiết bị vào log"""
         for result in results:
             self.log(result)
         
@@ -589,25 +829,19 @@ class SlaveLayerGUI(QWidget):
         """Bật/tắt auto test"""
         if self.auto_test_running:
             # Stop auto test
-            if self.auto_test_timer:
-                self.auto_test_timer.stop()
-                self.auto_test_timer = None
-            
+            self._worker.set_auto_test(False)
             self.auto_test_running = False
             self.btn_auto_test.setText("AUTO TEST (1 sec interval)")
-            self.lbl_auto_test_status.setText("OFF")
-            self.lbl_auto_test_status.setStyleSheet("font-weight: bold; color: #e74c3c;")
+            self._set(self.lbl_auto_test_status, "OFF", _STYLE_BAD)
             self.log("Auto test stopped")
         else:
             # Start auto test
             self.auto_test_running = True
             self.btn_auto_test.setText("STOP AUTO TEST")
-            self.lbl_auto_test_status.setText("ON")
-            self.lbl_auto_test_status.setStyleSheet("font-weight: bold; color: #27ae60;")
+            self._set(self.lbl_auto_test_status, "ON", _STYLE_OK)
             
-            self.auto_test_timer = QTimer()
-            self.auto_test_timer.timeout.connect(self.test_all_devices)
-            self.auto_test_timer.start(1000)  # 1 second interval
+            # Worker phát kết quả từ dữ liệu đã quét, không gửi thêm request
+            self._worker.set_auto_test(True)
             
             self.log("Auto test started (1 sec interval)")
     
@@ -616,16 +850,17 @@ class SlaveLayerGUI(QWidget):
         if "Listening" in text or "started" in text:
             self.log(f"Modbus TCP Server: {text}")
     
+    def update_master_connected(self, count: int):
+        """Cập nhật trạng thái Master (từ sự kiện kết nối của Modbus server)"""
+        self._set(self.lbl_master_connected, *_MASTER_LUT[count > 0])
+    
     def update_serial_status(self, text: str):
         """Cập nhật trạng thái serial"""
         self.log(f"RS485: {text}")
     
     def closeEvent(self, event):
         """Xử lý đóng cửa sổ"""
-        if self.auto_test_timer:
-            self.auto_test_timer.stop()
-        
-        self.timer.stop()
+        self._stop_io()
         self.device_manager.disconnect()
         self.plc_controller.stop_modbus_server()
         event.accept()
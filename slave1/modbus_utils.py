@@ -3,95 +3,154 @@
 Modbus RTU Helper Functions
 """
 
+import struct
+from array import array
+from functools import lru_cache
 
-def crc16_modbus(data: bytes) -> int:
-    """Tính CRC16 cho Modbus RTU"""
-    crc = 0xFFFF
-    for b in data:
-        crc ^= b
+
+def _crc16_table() -> array:
+    """Bảng CRC16 (poly 0xA001) cho 256 giá trị byte"""
+    table = array('H')
+    for b in range(256):
+        crc = b
         for _ in range(8):
             if crc & 1:
                 crc = (crc >> 1) ^ 0xA001
             else:
                 crc >>= 1
-    return crc & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc16_table()
+
+# Khung request 8 byte: slave, FC, addr/start, value/count (big-endian)
+# + CRC (đã đảo byte để ghi little-endian bằng cùng một Struct)
+_REQ_FRAME = struct.Struct(">BBHHH")
+_FC16_HEAD = struct.Struct(">BBHHB")     # slave, 0x10, start, count, byte count
+_CRC_LE = struct.Struct("<H")
+_S32_BE = struct.Struct(">i")
+
+# Struct cho khối N thanh ghi, tạo một lần cho mỗi N
+_REG_BLOCK = {}
+
+
+def _reg_block(count: int) -> struct.Struct:
+    """Struct '>NH' cho khối count thanh ghi (cache theo count)"""
+    s = _REG_BLOCK.get(count)
+    if s is None:
+        s = _REG_BLOCK[count] = struct.Struct(f">{count}H")
+    return s
+
+
+def crc16_modbus(data: bytes) -> int:
+    """Tính CRC16 cho Modbus RTU"""
+    crc = 0xFFFF
+    table = _CRC_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+def _crc16_6(b0: int, b1: int, b2: int, b3: int, b4: int, b5: int) -> int:
+    """CRC16 trải phẳng cho đúng 6 byte (phần đầu của request FC03/04/06)"""
+    t = _CRC_TABLE
+    crc = 0xFF ^ t[0xFF ^ b0]
+    crc = (crc >> 8) ^ t[(crc ^ b1) & 0xFF]
+    crc = (crc >> 8) ^ t[(crc ^ b2) & 0xFF]
+    crc = (crc >> 8) ^ t[(crc ^ b3) & 0xFF]
+    crc = (crc >> 8) ^ t[(crc ^ b4) & 0xFF]
+    return (crc >> 8) ^ t[(crc ^ b5) & 0xFF]
 
 
 def verify_crc(resp: bytes) -> bool:
     """Kiểm tra CRC của response"""
     if len(resp) < 5:
         return False
-    data = resp[:-2]
-    recv_crc = resp[-2] | (resp[-1] << 8)
-    calc_crc = crc16_modbus(data)
-    return recv_crc == calc_crc
-
-
+    # CRC tính trên cả frame (data + CRC little-endian) bằng 0 khi frame đúng
+    return crc16_modbus(resp) == 0
+
+
+def _build_request(slave_id: int, fc: int, addr: int, value: int) -> bytes:
+    """Đóng gói request 8 byte (FC03/04/06)"""
+    slave_id &= 0xFF
+    addr &= 0xFFFF
+    value &= 0xFFFF
+    crc = _crc16_6(slave_id, fc, addr >> 8, addr & 0xFF, value >> 8, value & 0xFF)
+    return _REQ_FRAME.pack(slave_id, fc, addr, value, ((crc & 0xFF) << 8) | (crc >> 8))
+
+
+def expected_response_length(frame: bytes):
+    """Độ dài response RTU bình thường của một request, None nếu không biết"""
+    fc = frame[1]
+    if fc in (0x03, 0x04):
+        # addr + func + bytecount + 2*N data + 2 CRC
+        return 5 + 2 * ((frame[4] << 8) | frame[5])
+    if fc in (0x06, 0x10):
+        # echo addr + func + 2 reg + 2 value/count + 2 CRC
+        return 8
+    return None
+
+
+def response_length_from_header(head: bytes):
+    """Độ dài response RTU suy từ 3 byte đầu (addr, func, bytecount), None nếu không biết"""
+    fc = head[1]
+    if fc & 0x80:
+        return 5                    # exception: addr + func + code + 2 CRC
+    if fc in (0x01, 0x02, 0x03, 0x04):
+        return 5 + head[2]
+    if fc in (0x05, 0x06, 0x0F, 0x10):
+        return 8
+    return None
+
+
+@lru_cache(maxsize=128)
 def build_fc03(slave_id: int, start_reg: int, count: int) -> bytes:
     """Build Function Code 03 - Read Holding Registers"""
-    data = bytes([
-        slave_id, 0x03,
-        (start_reg >> 8) & 0xFF, start_reg & 0xFF,
-        (count >> 8) & 0xFF, count & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    return _build_request(slave_id, 0x03, start_reg, count)
 
 
+@lru_cache(maxsize=128)
 def build_fc04(slave_id: int, start_reg: int, count: int) -> bytes:
     """Build Function Code 04 - Read Input Registers"""
-    data = bytes([
-        slave_id, 0x04,
-        (start_reg >> 8) & 0xFF, start_reg & 0xFF,
-        (count >> 8) & 0xFF, count & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    return _build_request(slave_id, 0x04, start_reg, count)
 
 
+@lru_cache(maxsize=128)
 def build_fc06(slave_id: int, reg_addr: int, reg_val: int) -> bytes:
     """Build Function Code 06 - Write Single Register"""
-    data = bytes([
-        slave_id, 0x06,
-        (reg_addr >> 8) & 0xFF, reg_addr & 0xFF,
-        (reg_val >> 8) & 0xFF, reg_val & 0xFF
-    ])
-    crc = crc16_modbus(data)
-    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    return _build_request(slave_id, 0x06, reg_addr, reg_val)
 
 
 def build_fc16(slave_id: int, start_reg: int, registers: list) -> bytes:
     """Build Function Code 16 - Write Multiple Registers"""
+    return _build_fc16(slave_id, start_reg, tuple(registers))
+
+
+@lru_cache(maxsize=128)
+def _build_fc16(slave_id: int, start_reg: int, registers: tuple) -> bytes:
+    """Frame FC16 cho registers dạng tuple (hashable, dùng được lru_cache)"""
     reg_count = len(registers)
-    byte_count = reg_count * 2
-    data = bytearray([
-        slave_id, 0x10,
-        (start_reg >> 8) & 0xFF, start_reg & 0xFF,
-        (reg_count >> 8) & 0xFF, reg_count & 0xFF,
-        byte_count
-    ])
-    for reg in registers:
-        data.append((reg >> 8) & 0xFF)
-        data.append(reg & 0xFF)
-    crc = crc16_modbus(bytes(data))
-    return bytes(data) + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
-
-
-def pack_u32(val: int) -> list:
-    """Pack unsigned 32-bit value to 2 registers"""
-    return [(val >> 16) & 0xFFFF, val & 0xFFFF]
-
-
-def pack_s32(val: int) -> list:
-    """Pack signed 32-bit value to 2 registers"""
+    frame = (_FC16_HEAD.pack(slave_id & 0xFF, 0x10, start_reg & 0xFFFF,
+                             reg_count, reg_count * 2)
+             + _reg_block(reg_count).pack(*[reg & 0xFFFF for reg in registers]))
+    return frame + _CRC_LE.pack(crc16_modbus(frame))
+
+
+@lru_cache(maxsize=512)
+def pack_u32(val: int) -> tuple:
+    """Pack unsigned 32-bit value to 2 registers (tuple cache, không sửa trực tiếp)"""
+    return ((val >> 16) & 0xFFFF, val & 0xFFFF)
+
+
+@lru_cache(maxsize=512)
+def pack_s32(val: int) -> tuple:
+    """Pack signed 32-bit value to 2 registers (tuple cache, không sửa trực tiếp)"""
     if val < 0:
         val = (1 << 32) + val
-    return [(val >> 16) & 0xFFFF, val & 0xFFFF]
+    return ((val >> 16) & 0xFFFF, val & 0xFFFF)
 
 
 def unpack_s32_from_bytes(b: bytes, offset: int) -> int:
     """Unpack signed 32-bit value from bytes"""
-    val = (b[offset] << 24) | (b[offset+1] << 16) | (b[offset+2] << 8) | b[offset+3]
-    if val & 0x80000000:
-        val = val - (1 << 32)
-    return val
\ No newline at end of file
+    return _S32_BE.unpack_from(b, offset)[0]
\ No newline at end of file
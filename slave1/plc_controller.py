@@ -5,15 +5,123 @@ PLC Controller - Logic điều khiển AUTO/MANUAL
 
 import time
 import threading
-from pyModbusTCP.server import ModbusServer
+from array import array
+from pyModbusTCP.server import ModbusServer, DataBank
 
 from config import (
     MODBUS_TCP_PORT, HR_TARGET_ADDR, HR_MODE_ADDR, HR_CMD_ADDR,
     HR_CMD_REG_COUNT, AUTO_MOVE_PULSES, AUTO_MOVE_SPEED,
-    AUTO_STATE_MAP
+    MotorState, HR_BANK_SIZE, IR_BANK_SIZE, IR_SLOW_FIELD_TICKS
 )
 from device_manager import DeviceManager
 
+# Số HR đầu bank mà auto_cycle cần (TARGET, MODE, khối CMD) → đọc 1 lần/chu kỳ
+HR_BLOCK_LEN = HR_CMD_ADDR + HR_CMD_REG_COUNT
+
+
+class ArrayDataBank(DataBank):
+    """DataBank lưu Holding/Input Registers trong array('H') (2 byte/thanh ghi)
+    
+    Chỉ ghi mới lấy lock; đọc không lock vì slice array là một thao tác
+    nguyên tử dưới GIL (kích thước array không đổi sau khi khởi tạo).
+    """
+    
+    def __init__(self, h_regs_size=HR_BANK_SIZE, i_regs_size=IR_BANK_SIZE,
+                 coils_size=0, d_inputs_size=0, **kwargs):
+        # DataBank gốc không cấp list 65536 phần tử cho HR/IR; array cấp ngay bên dưới.
+        # Coils / discrete inputs không dùng trong hệ thống → mặc định không cấp.
+        super().__init__(
+            coils_size=coils_size, d_inputs_size=d_inputs_size,
+            h_regs_size=0, i_regs_size=0, **kwargs
+        )
+        self.h_regs_size = int(h_regs_size)
+        self.i_regs_size = int(i_regs_size)
+        self._h_regs = array('H', bytes(2 * self.h_regs_size))
+        self._i_regs = array('H', bytes(2 * self.i_regs_size))
+    
+    def get_holding_registers(self, address, number=1, srv_info=None):
+        regs = self._h_regs
+        if (address >= 0) and (address + number <= len(regs)):
+            return regs[address:address + number].tolist()
+        return None
+    
+    def set_holding_registers(self, address, word_list, srv_info=None):
+        words = array('H', [int(w) & 0xFFFF for w in word_list])
+        end = address + len(words)
+        with self._h_regs_lock:
+            if not (address >= 0 and end <= len(self._h_regs)):
+                return None
+            old = self._h_regs[address:end]
+            self._h_regs[address:end] = words
+        # Ghi từ server → báo thay đổi như DataBank gốc
+        if srv_info:
+            for offset, (from_value, to_value) in enumerate(zip(old, words)):
+                if from_value != to_value:
+                    self.on_holding_registers_change(
+                        address + offset, from_value, to_value, srv_info=srv_info
+                    )
+        return True
+    
+    def get_input_registers(self, address, number=1, srv_info=None):
+        regs = self._i_regs
+        if (address >= 0) and (address + number <= len(regs)):
+            return regs[address:address + number].tolist()
+        return None
+    
+    def set_input_registers(self, address, word_list):
+        words = array('H', [int(w) & 0xFFFF for w in word_list])
+        end = address + len(words)
+        with self._i_regs_lock:
+            if not (address >= 0 and end <= len(self._i_regs)):
+                return None
+            self._i_regs[address:end] = words
+        return True
+    
+    def set_input_words(self, address, words):
+        """Ghi IR từ tuple/list đã nằm trong 0..0xFFFF (bỏ bước ép kiểu từng phần tử)"""
+        words = array('H', words)
+        end = address + len(words)
+        with self._i_regs_lock:
+            if not (address >= 0 and end <= len(self._i_regs)):
+                return None
+            self._i_regs[address:end] = words
+        return True
+
+
+class ClientTrackingServer(ModbusServer):
+    """ModbusServer báo số master đang kết nối qua on_clients(count)
+    
+    on_clients được gọi từ thread phục vụ client ngay khi TCP session
+    mở / đóng (setup / finish của request handler), không cần poll.
+    """
+    
+    def __init__(self, on_clients=None, **kwargs):
+        super().__init__(**kwargs)
+        self.on_clients = on_clients
+        self._clients = 0
+        self._clients_lock = threading.Lock()
+        
+        server = self
+        
+        class _Service(ModbusServer.ModbusService):
+            def setup(self):
+                super().setup()
+                server._client_delta(1)
+            
+            def finish(self):
+                server._client_delta(-1)
+                super().finish()
+        
+        # start() tạo ThreadingTCPServer với self.ModbusService
+        self.ModbusService = _Service
+    
+    def _client_delta(self, delta: int):
+        with self._clients_lock:
+            self._clients += delta
+            count = self._clients
+        if self.on_clients:
+            self.on_clients(count)
+
 
 class PLCController:
     """Điều khiển logic AUTO và MANUAL"""
@@ -24,45 +132,88 @@ class PLCController:
         
         # Modbus TCP Server
         self.modbus_server = None
+        self._data_bank = None    # = self.modbus_server.data_bank khi server đã tạo
         self.running = True
+        self._stop_evt = threading.Event()    # set → thread server thoát ngay
         
         # AUTO logic
         self.auto_enabled = True
-        self.motor_state = "Idle"
-        self.last_motor_cmd_time = time.time()
+        self.motor_state = MotorState.IDLE
+        self.last_motor_cmd_time = time.monotonic()
         self.last_tcp_target = 0
         self._last_mode_logged = -1
+        self._current_mode = 0    # MODE đọc ở auto_cycle gần nhất
+        self._last_exc_type = None  # loại exception đã log gần nhất (chống spam log)
+        self._last_sig = None       # đầu vào + state của lần chạy state machine AUTO gần nhất
         
-    def log(self, msg: str):
-        """Ghi log"""
-        if self.log_callback:
-            self.log_callback(msg)
+        # Bảng lệnh MANUAL: index = CMD, handler(pos_val, speed) → bool
+        dm = device_manager
+        self._manual_dispatch = (
+            None,                                               # 0: không có lệnh
+            lambda pos, speed: dm.motor_step_on(),              # 1: STEP ON
+            lambda pos, speed: dm.motor_step_off(),             # 2: STEP OFF
+            dm.motor_move_absolute,                             # 3: MOVE ABS
+            None,                                               # 4: (không dùng)
+            lambda pos, speed: dm.motor_jog_cw(speed),          # 5: JOG CW
+            lambda pos, speed: dm.motor_jog_ccw(speed),         # 6: JOG CCW
+            lambda pos, speed: dm.motor_stop(),                 # 7: STOP
+            lambda pos, speed: dm.motor_reset_alarm(),          # 8: RESET ALARM
+            lambda pos, speed: dm.motor_stop(),                 # 9: EMERGENCY STOP
+        )
+        
+        # Cache khối HR[0:HR_BLOCK_LEN], hết hạn khi auto_cycle tăng epoch
+        self._hr_epoch = 0
+        self._hr_block = None
+        self._hr_block_epoch = -1
+        
+        # Giá trị IR đã ghi lần cuối (None = chưa ghi)
+        self._last_ir_regs = None
+        
+        # temp/humi (x10) đã tính, làm mới mỗi IR_SLOW_FIELD_TICKS lần
+        self._slow_tick = 0
+        self._cached_temp = 0
+        self._cached_humi = 0
+        
+    def log(self, msg):
+        """Ghi log; msg có thể là hàm trả về chuỗi (chỉ format khi có log_callback)"""
+        cb = self.log_callback
+        if cb:
+            cb(msg() if callable(msg) else msg)
+    
+    def _log_error(self, prefix: str, e: Exception):
+        """Log lỗi ở vòng lặp nóng, chỉ log khi loại exception khác lần trước"""
+        if type(e) is not self._last_exc_type:
+            self._last_exc_type = type(e)
+            self.log(lambda: f"{prefix}: {e}")
     
-    def start_modbus_server(self, status_callback=None):
-        """Khởi động Modbus TCP Server"""
+    def start_modbus_server(self, status_callback=None, clients_callback=None):
+        """Khởi động Modbus TCP Server
+        
+        clients_callback(count): số master đang kết nối, gọi khi có kết nối mở/đóng
+        """
+        self.running = True
+        self._stop_evt.clear()
+        
         def server_thread():
             try:
-                self.modbus_server = ModbusServer(
+                data_bank = ArrayDataBank()
+                self.modbus_server = ClientTrackingServer(
+                    on_clients=clients_callback,
                     host="0.0.0.0",
                     port=MODBUS_TCP_PORT,
-                    no_block=True
+                    no_block=True,
+                    data_bank=data_bank
                 )
+                self._data_bank = data_bank
+                self._last_ir_regs = None   # bank mới → lần ghi IR kế tiếp ghi đủ
+                # Bank mới cấp đã = 0 toàn bộ (TARGET=0, MODE=AUTO, CMD=0)
                 self.modbus_server.start()
                 
-                # Init registers
-                self.modbus_server.data_bank.set_input_registers(0, [0] * 32)
-                hr_init = [0] * 100
-                hr_init[HR_TARGET_ADDR] = 0
-                hr_init[HR_MODE_ADDR] = 0
-                hr_init[HR_CMD_ADDR] = 0
-                self.modbus_server.data_bank.set_holding_registers(0, hr_init)
-                
                 if status_callback:
                     status_callback(f"Listening on {MODBUS_TCP_PORT}")
                 self.log(f"Modbus TCP Server started on port {MODBUS_TCP_PORT}")
                 
-                while self.running:
-                    time.sleep(0.5)
+                self._stop_evt.wait()
             except Exception as e:
                 self.log(f"Modbus server error: {e}")
                 if status_callback:
@@ -73,35 +224,55 @@ class PLCController:
     def stop_modbus_server(self):
         """Dừng Modbus TCP Server"""
         self.running = False
+        self._stop_evt.set()
         if self.modbus_server:
             try:
                 self.modbus_server.stop()
-            except:
+            except (OSError, RuntimeError, AttributeError):
                 pass
     
-    def get_mode(self) -> int:
+    def _read_hr_block(self):
+        """Khối HR[0:HR_BLOCK_LEN] của chu kỳ hiện tại (đọc data bank 1 lần/epoch)"""
+        if self._hr_block_epoch != self._hr_epoch:
+            data_bank = self._data_bank
+            self._hr_block = (
+                data_bank.get_holding_registers(0, HR_BLOCK_LEN)
+                if data_bank is not None else None
+            )
+            self._hr_block_epoch = self._hr_epoch
+        return self._hr_block
+    
+    def get_mode(self, regs=None) -> int:
         """Đọc MODE từ HR_MODE_ADDR (0=AUTO, 1=MANUAL)"""
-        if not self.modbus_server:
+        data_bank = self._data_bank
+        if data_bank is None:
             return 0
         try:
-            m = self.modbus_server.data_bank.get_holding_registers(HR_MODE_ADDR, 1)
+            if regs is not None:
+                m = regs[HR_MODE_ADDR:HR_MODE_ADDR + 1]
+            else:
+                m = data_bank.get_holding_registers(HR_MODE_ADDR, 1)
             if m and len(m) >= 1:
                 mode = m[0]
                 if mode != self._last_mode_logged:
-                    self.log(f"MODE from HR{HR_MODE_ADDR} = {mode}")
+                    self.log(lambda: f"MODE from HR{HR_MODE_ADDR} = {mode}")
                     self._last_mode_logged = mode
                 return mode
         except Exception as e:
-            self.log(f"Error reading HR_MODE: {e}")
+            self._log_error("Error reading HR_MODE", e)
         return 0
     
-    def check_target_from_tcp(self):
+    def check_target_from_tcp(self, regs=None):
         """Kiểm tra và cập nhật target từ Layer B/C"""
-        if not self.modbus_server:
+        data_bank = self._data_bank
+        if data_bank is None:
             return
         
         try:
-            hr = self.modbus_server.data_bank.get_holding_registers(HR_TARGET_ADDR, 1)
+            if regs is not None:
+                hr = regs[HR_TARGET_ADDR:HR_TARGET_ADDR + 1]
+            else:
+                hr = data_bank.get_holding_registers(HR_TARGET_ADDR, 1)
             if not hr or len(hr) < 1:
                 return
             
@@ -110,185 +281,210 @@ class PLCController:
             # Thay đổi target → gửi xuống Arduino
             if target != self.last_tcp_target:
                 self.last_tcp_target = target
-                self.log(f"TARGET HR{HR_TARGET_ADDR} = {target} → gửi xuống Arduino")
+                self.log(lambda: f"TARGET HR{HR_TARGET_ADDR} = {target} → gửi xuống Arduino")
                 
                 if self.device_manager.set_counter_target(target):
-                    self.log(f"Arduino nhận target = {target}")
+                    self.log(lambda: f"Arduino nhận target = {target}")
                     self.device_manager.counter_target = target
                 else:
                     self.log("Arduino không confirm target")
         
         except Exception as e:
-            self.log(f"Error reading HR{HR_TARGET_ADDR}: {e}")
+            self._log_error(f"Error reading HR{HR_TARGET_ADDR}", e)
     
-    def process_manual_command(self):
+    def process_manual_command(self, regs=None):
         """Xử lý lệnh MANUAL từ Layer B/C"""
-        if not self.modbus_server:
+        data_bank = self._data_bank
+        if data_bank is None:
             return
         
         try:
-            regs = self.modbus_server.data_bank.get_holding_registers(
-                HR_CMD_ADDR, HR_CMD_REG_COUNT
-            )
+            # Trường hợp thường gặp là không có lệnh (CMD = 0) → chỉ xem 1 thanh ghi
+            if regs is not None:
+                if len(regs) <= HR_CMD_ADDR or regs[HR_CMD_ADDR] == 0:
+                    return
+                regs = regs[HR_CMD_ADDR:HR_CMD_ADDR + HR_CMD_REG_COUNT]
+            else:
+                head = data_bank.get_holding_registers(HR_CMD_ADDR, 1)
+                if not head or head[0] == 0:
+                    return
+                regs = data_bank.get_holding_registers(
+                    HR_CMD_ADDR, HR_CMD_REG_COUNT
+                )
             if not regs or len(regs) < HR_CMD_REG_COUNT:
                 return
             
             cmd, pos_hi, pos_lo, speed, source_code, priority = regs
             
-            if cmd == 0:
-                return
-            
             # Chuyển đổi position
             pos_val = ((pos_hi & 0xFFFF) << 16) | (pos_lo & 0xFFFF)
-            if pos_val & 0x80000000:
-                pos_val -= (1 << 32)
+            pos_val = (pos_val ^ 0x80000000) - 0x80000000    # sign-extend 32 bit
             
             src_text = "B" if source_code == 2 else ("C" if source_code == 3 else "Unknown")
             
-            self.log(
+            self.log(lambda: (
                 f"MANUAL CMD={cmd} from {src_text} "
                 f"prio={priority}, pos={pos_val}, speed={speed}"
-            )
+            ))
             
-            # Xử lý từng lệnh
+            # Xử lý lệnh qua bảng dispatch
             success = False
-            if cmd == 1:  # STEP ON
-                success = self.device_manager.motor_step_on()
-            elif cmd == 2:  # STEP OFF
-                success = self.device_manager.motor_step_off()
-            elif cmd == 3:  # MOVE ABS
-                success = self.device_manager.motor_move_absolute(pos_val, speed)
-            elif cmd == 5:  # JOG CW
-                success = self.device_manager.motor_jog_cw(speed)
-            elif cmd == 6:  # JOG CCW
-                success = self.device_manager.motor_jog_ccw(speed)
-            elif cmd == 7:  # STOP
-                success = self.device_manager.motor_stop()
-            elif cmd == 8:  # RESET ALARM
-                success = self.device_manager.motor_reset_alarm()
-            elif cmd == 9:  # EMERGENCY STOP
-                success = self.device_manager.motor_stop()
+            table = self._manual_dispatch
+            if cmd < len(table) and table[cmd] is not None:
+                success = table[cmd](pos_val, speed)
             
             # Clear CMD
-            self.modbus_server.data_bank.set_holding_registers(HR_CMD_ADDR, [0])
+            data_bank.set_holding_registers(HR_CMD_ADDR, [0])
         
         except Exception as e:
-            self.log(f"Error in process_manual_command: {e}")
+            self._log_error("Error in process_manual_command", e)
     
     def auto_cycle(self):
         """Chu kỳ AUTO - lặp nhiều chu kỳ"""
+        # Đọc TARGET/MODE/CMD bằng một lần get_holding_registers
+        self._hr_epoch += 1
+        regs = self._read_hr_block()
+        
         # Cập nhật target từ Layer B/C
-        self.check_target_from_tcp()
+        self.check_target_from_tcp(regs)
         
         # Đọc MODE
-        mode = self.get_mode()
+        mode = self.get_mode(regs)
+        self._current_mode = mode
+        
+        dm = self.device_manager
+        state = self.motor_state
+        now = time.monotonic()
         
         # ---------- MANUAL MODE ----------
         if mode == 1:
-            self.motor_state = "Manual"
-            self.process_manual_command()
+            self.motor_state = MotorState.MANUAL
+            self.process_manual_command(regs)
             return
         
         # ---------- AUTO MODE ----------
+        # Đầu vào và state y như lần trước → state machine cho cùng kết quả, bỏ qua.
+        # "Motor running" luôn chạy lại vì có timeout theo thời gian.
+        sig = (
+            self.auto_enabled, dm.driver_alarm, dm.driver_inpos,
+            dm.counter_done, dm.counter_value, dm.counter_target, state
+        )
+        if state != MotorState.MOTOR_RUNNING and sig == self._last_sig:
+            return
+        self._last_sig = sig
+        
         if not self.auto_enabled:
-            self.motor_state = "Disabled"
+            self.motor_state = MotorState.DISABLED
             return
         
-        if self.device_manager.driver_alarm:
-            if self.motor_state != "Alarm":
+        if dm.driver_alarm:
+            if state != MotorState.ALARM:
                 self.log("AUTO stopped: driver alarm.")
-            self.motor_state = "Alarm"
+            self.motor_state = MotorState.ALARM
             return
         
-        if self.device_manager.counter_target <= 0:
-            self.motor_state = "Waiting target"
+        if dm.counter_target <= 0:
+            self.motor_state = MotorState.WAITING_TARGET
             return
         
         # 1. Counter DONE và motor KHÔNG chạy → phát lệnh chạy motor
-        if (self.device_manager.counter_done and 
-            self.motor_state not in ("Motor running", "Alarm")):
+        if (dm.counter_done and 
+            state not in (MotorState.MOTOR_RUNNING, MotorState.ALARM)):
             
-            if self.device_manager.motor_move_absolute(AUTO_MOVE_PULSES, AUTO_MOVE_SPEED):
-                self.device_manager.current_speed = AUTO_MOVE_SPEED
-                self.motor_state = "Motor running"
-                self.last_motor_cmd_time = time.time()
-                self.log(
+            # Có phát lệnh → tick sau phải xét lại (thử lại nếu lệnh lỗi)
+            self._last_sig = None
+            if dm.motor_move_absolute(AUTO_MOVE_PULSES, AUTO_MOVE_SPEED):
+                dm.current_speed = AUTO_MOVE_SPEED
+                self.motor_state = MotorState.MOTOR_RUNNING
+                self.last_motor_cmd_time = now
+                self.log(lambda: (
                     f"AUTO: count reached target "
-                    f"({self.device_manager.counter_value}/"
-                    f"{self.device_manager.counter_target}), "
+                    f"({dm.counter_value}/{dm.counter_target}), "
                     f"run motor +{AUTO_MOVE_PULSES} pulses."
-                )
+                ))
             return
         
         # 2. Motor đang chạy → chờ INPOS hoặc TIMEOUT
-        if self.motor_state == "Motor running":
-            if self.device_manager.driver_inpos:
-                if self.device_manager.reset_counter():
-                    self.motor_state = "Waiting reset"
-                    self.last_motor_cmd_time = time.time()
+        if state == MotorState.MOTOR_RUNNING:
+            if dm.driver_inpos:
+                if dm.reset_counter():
+                    self.motor_state = MotorState.WAITING_RESET
+                    self.last_motor_cmd_time = now
                     self.log("AUTO: motor in-position, reset counter (HR3=1).")
-            elif time.time() - self.last_motor_cmd_time > 10:
-                self.motor_state = "Timeout motor"
+            elif now - self.last_motor_cmd_time > 10:
+                self.motor_state = MotorState.TIMEOUT_MOTOR
                 self.log("AUTO: timeout waiting for motor InPos.")
             return
         
         # 3. Đang chờ Arduino RESET counter
-        if self.motor_state == "Waiting reset":
-            if (self.device_manager.counter_value == 0 and 
-                not self.device_manager.counter_done):
-                self.motor_state = "Idle"
+        if state == MotorState.WAITING_RESET:
+            if dm.counter_value == 0 and not dm.counter_done:
+                self.motor_state = MotorState.IDLE
                 self.log("AUTO: new cycle started (counter reset).")
             return
         
         # 4. Các trạng thái còn lại
-        if self.motor_state not in (
-            "Idle", "Waiting count", "Waiting target", "Timeout motor"
+        if state not in (
+            MotorState.IDLE, MotorState.WAITING_COUNT,
+            MotorState.WAITING_TARGET, MotorState.TIMEOUT_MOTOR
         ):
-            self.motor_state = "Waiting count"
-        elif not self.device_manager.counter_done:
-            self.motor_state = "Waiting count"
+            self.motor_state = MotorState.WAITING_COUNT
+        elif not dm.counter_done:
+            self.motor_state = MotorState.WAITING_COUNT
     
     def update_input_registers(self):
         """Cập nhật Input Registers cho Layer B/C"""
-        if not self.modbus_server:
+        data_bank = self._data_bank
+        if data_bank is None:
             return
         
+        dm = self.device_manager
         try:
-            pos = self.device_manager.current_position
-            if pos < 0:
-                pos_val = (1 << 32) + pos
-            else:
-                pos_val = pos
+            pos_val = dm.current_position & 0xFFFFFFFF
             pos_hi = (pos_val >> 16) & 0xFFFF
             pos_lo = pos_val & 0xFFFF
             
-            speed = max(0, min(int(self.device_manager.current_speed), 0xFFFF))
-            temp = max(-32768, min(int(self.device_manager.temperature * 10), 32767)) & 0xFFFF
-            humi = max(0, min(int(self.device_manager.humidity * 10), 0xFFFF))
+            speed = min(max(int(dm.current_speed), 0), 0xFFFF)
+            if self._slow_tick % IR_SLOW_FIELD_TICKS == 0:
+                self._cached_temp = max(-32768, min(int(dm.temperature * 10), 32767)) & 0xFFFF
+                self._cached_humi = min(max(int(dm.humidity * 10), 0), 0xFFFF)
+            self._slow_tick += 1
+            temp = self._cached_temp
+            humi = self._cached_humi
             
-            status_word = 0
-            if self.device_manager.driver_alarm:
-                status_word |= 1 << 0
-            if self.device_manager.driver_inpos:
-                status_word |= 1 << 1
-            if self.device_manager.driver_running:
-                status_word |= 1 << 2
+            # bit0 = alarm, bit1 = inpos, bit2 = running
+            status_word = (
+                int(dm.driver_alarm)
+                | (int(dm.driver_inpos) << 1)
+                | (int(dm.driver_running) << 2)
+            )
             
-            auto_code = AUTO_STATE_MAP.get(self.motor_state, 0)
-            mode_val = self.get_mode()
+            auto_code = int(self.motor_state)
+            mode_val = self._current_mode
             
-            regs = [
+            regs = (
                 pos_hi,
                 pos_lo,
                 speed,
                 temp,
                 humi,
                 status_word,
-                self.device_manager.counter_value,
-                self.device_manager.counter_target,
+                dm.counter_value,
+                dm.counter_target,
                 auto_code,
                 mode_val,
-            ]
-            self.modbus_server.data_bank.set_input_registers(0, regs)
+            )
+            last = self._last_ir_regs
+            if regs == last:
+                return
+            
+            if last is None:
+                data_bank.set_input_words(0, regs)
+            else:
+                # Chỉ ghi đoạn liên tục từ thanh ghi đổi đầu tiên tới cuối cùng
+                changed = [i for i, (a, b) in enumerate(zip(regs, last)) if a != b]
+                first, end = changed[0], changed[-1] + 1
+                data_bank.set_input_words(first, regs[first:end])
+            self._last_ir_regs = regs
         except Exception as e:
-            self.log(f"Error updating input regs: {e}")
\ No newline at end of file
+            self._log_error("Error updating input regs", e)
\ No newline at end of file
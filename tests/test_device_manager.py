@@ -0,0 +1,184 @@
+# test_device_manager.py
+"""
+Kiểm tra DeviceManager.read_driver_block: đọc gộp 0x1000..0x1010 và
+chuyển sang đọc riêng position / status khi driver không đọc gộp được
+"""
+
+import os
+import struct
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "slave1"))
+
+from config import SLAVE_ID_DRIVER, DRIVER_REG_BLOCK_COUNT, DRIVER_BLOCK_MAX_FAILS  # noqa: E402
+from device_manager import DeviceManager  # noqa: E402
+from modbus_utils import crc16_modbus  # noqa: E402
+
+
+def _with_crc(body: bytes) -> bytes:
+    return body + struct.pack("<H", crc16_modbus(body))
+
+
+def _fc03_response(words) -> bytes:
+    data = b"".join(struct.pack(">H", w) for w in words)
+    return _with_crc(bytes([SLAVE_ID_DRIVER, 0x03, len(data)]) + data)
+
+
+class FakeSerial:
+    """Serial giả: mỗi frame ghi vào trả về response đã định theo frame"""
+
+    def __init__(self, responses):
+        self.responses = responses    # frame -> bytes (b"" = không trả lời)
+        self.written = []
+        self.is_open = True
+        self.bytesize = 8
+        self.stopbits = 1
+        self._rx = b""
+
+    def reset_input_buffer(self):
+        self._rx = b""
+
+    def write(self, frame):
+        self.written.append(bytes(frame))
+        self._rx = self.responses.get(bytes(frame), b"")
+
+    def flush(self):
+        pass
+
+    def read(self, n):
+        data, self._rx = self._rx[:n], self._rx[n:]
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+class ReadDriverBlockTest(unittest.TestCase):
+
+    POSITION = -12345
+    STATUS = (1 << 4) | (1 << 2)    # INPOS + RUN
+
+    def setUp(self):
+        self.dm = DeviceManager()
+        pos_hi, pos_lo = struct.unpack(">HH", struct.pack(">i", self.POSITION))
+        self.separate = {
+            self.dm._frame_read_pos: _fc03_response([pos_hi, pos_lo]),
+            self.dm._frame_read_status: _fc03_response([self.STATUS]),
+        }
+        self.block_words = [pos_hi, pos_lo] + [0] * (DRIVER_REG_BLOCK_COUNT - 3) + [self.STATUS]
+
+    def _connect(self, block_response):
+        responses = dict(self.separate)
+        responses[self.dm._frame_read_driver_block] = block_response
+        self.dm.ser = FakeSerial(responses)
+        return self.dm.ser
+
+    def _assert_values(self):
+        self.assertEqual(self.dm.current_position, self.POSITION)
+        self.assertTrue(self.dm.driver_inpos)
+        self.assertTrue(self.dm.driver_running)
+        self.assertFalse(self.dm.driver_alarm)
+
+    def test_block_read(self):
+        ser = self._connect(_fc03_response(self.block_words))
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, True)
+        self.assertEqual(ser.written, [self.dm._frame_read_driver_block])
+        self._assert_values()
+
+    def test_exception_response_falls_back(self):
+        ser = self._connect(_with_crc(bytes([SLAVE_ID_DRIVER, 0x83, 0x02])))
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, False)
+        self._assert_values()
+
+        # Từ đó chỉ đọc riêng, không gửi lại frame đọc gộp
+        ser.written.clear()
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertEqual(ser.written, [self.dm._frame_read_pos, self.dm._frame_read_status])
+
+    def test_single_timeout_keeps_block_mode(self):
+        ser = self._connect(b"")
+        self.assertFalse(self.dm.read_driver_block())
+        self.assertIsNone(self.dm._driver_block_ok)
+
+        # Driver trả lời từ lần poll sau (vừa khởi động xong) → vẫn đọc gộp
+        ser.responses[self.dm._frame_read_driver_block] = _fc03_response(self.block_words)
+        ser.written.clear()
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, True)
+        self.assertEqual(ser.written, [self.dm._frame_read_driver_block])
+        self._assert_values()
+
+    def test_no_response_falls_back_after_max_fails(self):
+        self._connect(b"")
+        for _ in range(DRIVER_BLOCK_MAX_FAILS - 1):
+            self.assertFalse(self.dm.read_driver_block())
+            self.assertIsNone(self.dm._driver_block_ok)
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, False)
+        self._assert_values()
+
+    def test_garbled_response_falls_back_after_max_fails(self):
+        garbled = _fc03_response(self.block_words)[:-1] + b"\x00"
+        self._connect(garbled)
+        for _ in range(DRIVER_BLOCK_MAX_FAILS - 1):
+            self.assertFalse(self.dm.read_driver_block())
+            self.assertIsNone(self.dm._driver_block_ok)
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, False)
+        self._assert_values()
+
+    def test_failure_after_block_ok_keeps_block_mode(self):
+        ser = self._connect(_fc03_response(self.block_words))
+        self.assertTrue(self.dm.read_driver_block())
+        ser.responses[self.dm._frame_read_driver_block] = b""
+        for _ in range(DRIVER_BLOCK_MAX_FAILS):
+            self.assertFalse(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, True)
+
+    def test_reconnect_retries_block_mode(self):
+        self._connect(_with_crc(bytes([SLAVE_ID_DRIVER, 0x83, 0x02])))
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, False)
+        self.dm.disconnect()
+
+        responses = dict(self.separate)
+        responses[self.dm._frame_read_driver_block] = _fc03_response(self.block_words)
+        ser = FakeSerial(responses)
+        with mock.patch("device_manager.serial.Serial", return_value=ser):
+            ok, _ = self.dm.connect("COM1", 9600)
+        self.assertTrue(ok)
+        self.assertIsNone(self.dm._driver_block_ok)
+
+        self.assertTrue(self.dm.read_driver_block())
+        self.assertIs(self.dm._driver_block_ok, True)
+        self.assertEqual(ser.written, [self.dm._frame_read_driver_block])
+        self._assert_values()
+
+
+class ReadResponseTest(unittest.TestCase):
+    """Response không biết trước độ dài: suy độ dài từ header"""
+
+    def _read(self, response, trailing=b"\xAA\xBB"):
+        dm = DeviceManager()
+        dm.ser = FakeSerial({})
+        dm.ser._rx = response + trailing    # byte thừa sau frame không được đọc
+        return dm._read_response(None)
+
+    def test_fc03_length_from_bytecount(self):
+        resp = _fc03_response([1, 2, 3])
+        self.assertEqual(self._read(resp), resp)
+
+    def test_exception_response(self):
+        resp = _with_crc(bytes([SLAVE_ID_DRIVER, 0x83, 0x02]))
+        self.assertEqual(self._read(resp), resp)
+
+    def test_short_response(self):
+        self.assertEqual(self._read(b"\x02", trailing=b""), b"\x02")
+
+
+if __name__ == "__main__":
+    unittest.main()